@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Plot preparation time of counting in Python against the aggregates of the store.
+
+- python: every affiliation country read with get_documents_country and
+  counted and sorted in Python, the way Plotter.count_clean_countries does,
+  and the continents resolved with Location.continent_map.
+- sql: count_by_country and count_by_continent, one GROUP BY each over the
+  covering index of affiliation_country.
+
+Run from the repository root:
+
+    PYTHONPATH=src:. python benchmarks/bench_aggregates.py
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from collections import Counter
+
+from bench_projection import generated_entry
+
+from core.crud import SqlAlchemyORM
+from core.parsing import document_row
+from core.utils import Location
+
+COUNTRIES = ["Spain", "Germany", "United States", "China", "India", "Brazil", "Japan", "France", "Kenya", None]
+
+
+def python_counts(orm: SqlAlchemyORM):
+    country_count = Counter(country for country in orm.get_documents_country() if country is not None)
+    by_country = sorted(country_count.items(), key=lambda x: x[1], reverse=True)
+    continents, _ = Location().continent_map(country_count)
+    by_continent = Counter()
+    for country, count in country_count.items():
+        by_continent[continents[country]] += count
+    return by_country, by_continent
+
+
+def sql_counts(orm: SqlAlchemyORM):
+    return orm.count_by_country(), Counter(dict(orm.count_by_continent()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, nargs="+", default=[10000, 40000, 160000], help="Documents stored.")
+    parser.add_argument("--repeat", type=int, default=5, help="Preparations timed per method.")
+    args = parser.parse_args()
+
+    entry = generated_entry(0)
+    print(f"{'documents':>10}{'python ms':>11}{'sql ms':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        orm = SqlAlchemyORM(os.path.join(tmp, "documents.db"))
+        orm.db.create_database()
+        continents, _ = Location().continent_map(c for c in COUNTRIES if c)
+        orm.set_continent(continents.items())
+        stored = 0
+        for n in sorted(args.documents):
+            rows = []
+            for i in range(stored, n):
+                affiliation = [{"affiliation-country": COUNTRIES[i % len(COUNTRIES)]}]
+                fields = {"eid": f"2-s2.0-{i}", "prism:doi": f"10.1/{i}", "affiliation": affiliation}
+                rows.append(document_row(dict(entry, **fields), "q", "Scopus"))
+            inserted, _ = orm.save_rows(rows)
+            assert inserted == n - stored
+            stored = n
+
+            python_result, sql_result = python_counts(orm), sql_counts(orm)
+            assert python_result[1] == sql_result[1]
+            timings = []
+            for method in (python_counts, sql_counts):
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    method(orm)
+                timings.append((time.perf_counter() - start) * 1000 / args.repeat)
+            print(f"{n:>10}{timings[0]:>11.1f}{timings[1]:>8.1f}")
+        orm.db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Parse time and peak memory of a search page for every parsing path.
+
+- json + Document: the former path, json.loads of the whole body and a
+  Document instance per entry.
+- loads + rows: the whole body decoded at once (orjson when installed) and
+  the document rows read directly from the entries.
+- stream + rows: the body decoded incrementally with ijson, from a file
+  that stands for the socket, one entry at a time.
+
+Every path runs in its own process, so its peak RSS is not shared with the
+others. The pages have the shape of COMPLETE view pages. Run from the
+repository root:
+
+    PYTHONPATH=src:. python benchmarks/bench_parsing.py
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench_projection import generated_entry
+
+from core.parsing import SearchPage, available_parsers, document_row, orjson
+
+PATHS = ["json + Document", "loads + rows", "stream + rows"]
+
+
+def rss_kb():
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmRSS"))
+
+
+def parse(path: str, filename: str):
+    from core.models import Document
+
+    if path == "json + Document":
+        with open(filename, "rb") as f:
+            entries = json.loads(f.read())["search-results"]["entry"]
+        return [Document(**document_row(e, "query", "Scopus")._asdict()) for e in entries]
+
+    with open(filename, "rb") as f:
+        page = SearchPage(f, "loads" if path == "loads + rows" else "stream")
+        return [document_row(e, "query", "Scopus") for e in page.entries()]
+
+
+def run(path: str, filename: str, pages: int):
+    # Parse the page in this process and print its time, Python peak and RSS peak
+    parse(path, filename)
+    before = rss_kb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(pages):
+        rows = parse(path, filename)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(pages):
+        rows = parse(path, filename)
+    untraced = time.perf_counter() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    print(
+        json.dumps(
+            {
+                "rows": len(rows),
+                "ms": untraced * 1000 / pages,
+                "traced_ms": elapsed * 1000 / pages,
+                "peak_kb": peak / 1024,
+                "rss_kb": max(rss, 0),
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--entries", type=int, default=200, help="Entries per page.")
+    parser.add_argument("--pages", type=int, default=20, help="Pages parsed per path.")
+    parser.add_argument("--run", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run[0], args.run[1], args.pages)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        links = [{"@ref": "next", "@href": "https://api.elsevier.com/content/search/scopus?cursor=next"}]
+        entries = [generated_entry(i) for i in range(args.entries)]
+        f.write(json.dumps({"search-results": {"link": links, "entry": entries}}).encode())
+    size = os.path.getsize(f.name)
+
+    print(
+        f"{args.entries} entries, {size / 1024:.0f} KB per page, orjson {'on' if orjson else 'off'}, "
+        f"parsers {', '.join(available_parsers())}"
+    )
+    print(f"{'path':<16}{'ms/page':>10}{'peak KB':>10}{'RSS KB':>10}")
+    try:
+        for path in PATHS:
+            if path == "stream + rows" and "stream" not in available_parsers():
+                print(f"{path:<16}{'ijson is not installed':>30}")
+                continue
+            out = subprocess.run(
+                [sys.executable, __file__, "--pages", str(args.pages), "--run", path, f.name],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            result = json.loads(out)
+            print(f"{path:<16}{result['ms']:>10.2f}{result['peak_kb']:>10.0f}{result['rss_kb']:>10.0f}")
+    finally:
+        os.unlink(f.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Bytes per page, pages per query and harvest time of every search projection.
+
+The search endpoint is emulated by a local stub that serves COMPLETE view
+entries and applies the view, count and field parameters of every request
+the way the Scopus Search API does. The entries are taken from recorded
+search responses (--recorded, JSON files of whole search pages), or else
+generated with the shape of a COMPLETE entry. Every page takes
+--latency-ms plus its transfer time at --mbps. Run from the repository root:
+
+    PYTHONPATH=src:. python benchmarks/bench_projection.py
+    PYTHONPATH=src:. python benchmarks/bench_projection.py --recorded responses/*.json
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import string
+import tempfile
+import time
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from core.crud import SqlAlchemyORM
+from core.harvest import Harvester
+from core.ratelimit import AdaptiveRateLimiter
+from core.scopus import PROJECTIONS
+from core.transport import configure_transport
+from tests.stub_server import StubServer
+
+# Fields of the COMPLETE view left out of the STANDARD view
+COMPLETE_ONLY = ("dc:description", "authkeywords", "author", "author-count", "fund-acr", "fund-no", "fund-sponsor")
+
+
+def words(rng: random.Random, n: int):
+    # Random text, so the pages compress like real ones
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(n))
+
+
+def generated_entry(i: int):
+    # Entry with the fields and sizes of a typical COMPLETE view search result
+    rng = random.Random(i)
+    affiliations = [
+        {
+            "@_fa": "true",
+            "affiliation-url": f"https://api.elsevier.com/content/affiliation/affiliation_id/6000{i % 97}{a}",
+            "afid": f"6000{i % 97}{a}",
+            "affilname": words(rng, 4),
+            "affiliation-city": "Madrid",
+            "affiliation-country": ["Spain", "Germany", "United States"][a],
+        }
+        for a in range(3)
+    ]
+    authors = [
+        {
+            "@_fa": "true",
+            "@seq": str(a + 1),
+            "author-url": f"https://api.elsevier.com/content/author/author_id/5720{i}{a}",
+            "authid": f"5720{i}{a}",
+            "authname": f"{words(rng, 1)} N.",
+            "surname": words(rng, 1),
+            "given-name": words(rng, 1),
+            "initials": "N.",
+            "afid": [{"@_fa": "true", "$": f"6000{i % 97}{a % 3}"}],
+        }
+        for a in range(6)
+    ]
+    return {
+        "@_fa": "true",
+        "link": [
+            {"@_fa": "true", "@ref": ref, "@href": f"https://www.scopus.com/{ref}/2-s2.0-{i}"}
+            for ref in ("self", "author-affiliation", "scopus", "scopus-citedby")
+        ],
+        "prism:url": f"https://api.elsevier.com/content/abstract/scopus_id/{i}",
+        "dc:identifier": f"SCOPUS_ID:{i}",
+        "eid": f"2-s2.0-{i}",
+        "dc:title": words(rng, 12),
+        "dc:creator": "Surname0 N.",
+        "prism:publicationName": "Journal of Systems and Software",
+        "prism:issn": "01641212",
+        "prism:eIssn": "18731228",
+        "prism:volume": "201",
+        "prism:pageRange": "1-20",
+        "prism:coverDate": "2022-05-01",
+        "prism:coverDisplayDate": "May 2022",
+        "prism:doi": f"10.1016/j.jss.2022.{i}",
+        "dc:description": words(rng, 220),
+        "citedby-count": str(i % 50),
+        "affiliation": affiliations,
+        "prism:aggregationType": "Journal",
+        "subtype": "ar",
+        "subtypeDescription": "Article",
+        "author-count": {"@limit": "100", "@total": "6", "$": "6"},
+        "author": authors,
+        "authkeywords": " | ".join(words(rng, 2) for _ in range(5)),
+        "article-number": str(i),
+        "source-id": "19309",
+        "fund-acr": "ERDF",
+        "fund-no": "undefined",
+        "fund-sponsor": "European Regional Development Fund",
+        "openaccess": "0",
+        "openaccessFlag": False,
+    }
+
+
+def project(entry: dict, view: str, fields: list):
+    # Apply the view and field parameters to a COMPLETE view entry
+    if view == "STANDARD":
+        entry = {k: v for k, v in entry.items() if k not in COMPLETE_ONLY}
+    if fields:
+        projected = {k: v for k, v in entry.items() if k in fields}
+        if "affiliation-country" in fields and "affiliation" in entry:
+            projected["affiliation"] = [{"affiliation-country": a["affiliation-country"]} for a in entry["affiliation"]]
+        entry = projected
+    return entry
+
+
+class SearchStub:
+    def __init__(self, entries: list, per_query: int, latency: float, mbps: float):
+        self.entries = entries
+        self.per_query = per_query
+        self.latency = latency
+        self.mbps = mbps
+        self.pages = 0
+        self.bytes = 0
+        self.gzip_bytes = 0
+
+    def __call__(self, method, path):
+        params = {k: v[-1] for k, v in parse_qs(urlsplit(path).query).items()}
+        view = params.get("view", "STANDARD")
+        count = min(int(params.get("count", 25)), 25 if view == "COMPLETE" else 200)
+        fields = params["field"].split(",") if "field" in params else None
+        start = 0 if params["cursor"] == "*" else int(params["cursor"])
+        seed = sum(map(ord, params["query"])) * 100000
+
+        entries = []
+        for i in range(start, min(start + count, self.per_query)):
+            entry = dict(self.entries[i % len(self.entries)], eid=f"2-s2.0-{seed + i}")
+            entries.append(project(entry, view, fields))
+        links = []
+        if start + count < self.per_query:
+            params["cursor"] = str(start + count)
+            links.append({"@ref": "next", "@href": f"{self.url}/content/search/scopus?{urlencode(params)}"})
+        body = json.dumps({"search-results": {"entry": entries, "link": links}}).encode()
+
+        compressed = len(gzip.compress(body))
+        self.pages += 1
+        self.bytes += len(body)
+        self.gzip_bytes += compressed
+        time.sleep(self.latency + compressed * 8 / (self.mbps * 1e6))
+        return 200, {"Content-Type": "application/json"}, body
+
+
+def recorded_entries(paths: list):
+    entries = []
+    for path in paths:
+        with open(path) as f:
+            entries.extend(json.load(f)["search-results"].get("entry", []))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--recorded", nargs="*", default=[], help="Recorded COMPLETE view search pages.")
+    parser.add_argument("--queries", type=int, default=4, help="Queries harvested.")
+    parser.add_argument("--per-query", type=int, default=600, help="Results of every query.")
+    parser.add_argument("--latency-ms", type=float, default=150, help="Emulated latency of every page.")
+    parser.add_argument("--mbps", type=float, default=20, help="Emulated bandwidth.")
+    args = parser.parse_args()
+
+    os.environ.setdefault("ELSEVIER_API_KEY", "benchmark")
+    entries = recorded_entries(args.recorded) or [generated_entry(i) for i in range(100)]
+    queries = [f"TITLE-ABS-KEY('q{i}')" for i in range(args.queries)]
+    configure_transport(pool_size=4)
+
+    print(f"{'projection':<12}{'KB/page':>10}{'gzip KB/page':>14}{'pages/query':>13}{'harvest s':>11}")
+    for projection in PROJECTIONS:
+        stub_route = SearchStub(entries, args.per_query, args.latency_ms / 1000, args.mbps)
+        with StubServer(stub_route) as stub, tempfile.TemporaryDirectory() as tmp:
+            stub_route.url = stub.url
+            orm = SqlAlchemyORM(os.path.join(tmp, "documents.db"))
+            orm.db.create_database()
+            h = Harvester(
+                lambda orm=orm: orm,
+                queries,
+                "2018-2022",
+                workers=4,
+                rate_limiter=AdaptiveRateLimiter(rate=1000, burst=100),
+                projection=projection,
+                api_url=stub.url,
+            )
+            start = time.perf_counter()
+            h.run()
+            elapsed = time.perf_counter() - start
+        pages = stub_route.pages
+        print(
+            f"{projection:<12}{stub_route.bytes / pages / 1024:>10.1f}{stub_route.gzip_bytes / pages / 1024:>14.1f}"
+            f"{pages / len(queries):>13.1f}{elapsed:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
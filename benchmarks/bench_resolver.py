@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+DOIs resolved per second by a sequential GET chain against the concurrent DoiResolver.
+
+The DOIs are resolved through a local stub that emulates doi.org: every DOI
+redirects to a publisher host, which redirects again to the landing page of
+the article, and every response takes --latency-ms. The GET chain, the
+former Editorial.get_editorial, follows the whole chain with GET, one DOI
+at a time (its 2 calls/s limit is left out), while DoiResolver follows the
+same chain with HEAD requests, so the landing page is never downloaded. Run from the repository root:
+
+    PYTHONPATH=src:. python benchmarks/bench_resolver.py
+"""
+
+import argparse
+import time
+
+from core.crud import SqlAlchemyORM
+from core.resolver import DoiResolver
+from core.transport import Transport
+from tests.stub_server import StubServer
+
+
+def make_route(latency: float):
+    def route(method, path):
+        time.sleep(latency)
+        if path.startswith("/doi/"):
+            # The publisher is the same stub under another host name
+            return 302, {"Location": f"http://localhost:{route.port}/linking{path[4:]}"}, b""
+        if path.startswith("/linking/"):
+            return 301, {"Location": f"/article{path[8:]}"}, b""
+        return 200, {"Content-Type": "text/html"}, b"<html>" + b"x" * 20000 + b"</html>"
+
+    return route
+
+
+def get_chain(url: str, dois: list, workers: int):
+    # Former Editorial.get_editorial, the host of the url reached by following the redirects
+    transport = Transport()
+    for doi in dois:
+        transport.get(f"{url}/doi/{doi}", allow_redirects=True, timeout=30).url.split("/")[2]
+
+
+def resolver(url: str, dois: list, workers: int):
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    transport = Transport(pool_size=workers)
+    r = DoiResolver(transport=transport, resolver_url=f"{url}/doi/", workers=workers, per_host=workers)
+    r.resolve_all(dois, store=orm)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", type=int, default=400, help="DOIs per run.")
+    parser.add_argument("--workers", type=int, default=16, help="Workers of the resolver.")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Emulated latency of every response.")
+    args = parser.parse_args()
+
+    dois = [f"10.1000/{i}" for i in range(args.n)]
+    print(f"{'client':<22}{'requests':>10}{'connections':>13}{'DOIs/s':>10}")
+    for label, client in (("GET chain", get_chain), ("DoiResolver (HEAD)", resolver)):
+        route = make_route(args.latency_ms / 1000)
+        with StubServer(route) as stub:
+            route.port = stub.url.rsplit(":", 1)[1]
+            start = time.perf_counter()
+            client(stub.url, dois, args.workers)
+            elapsed = time.perf_counter() - start
+            print(f"{label:<22}{len(stub.requests):>10}{stub.connections:>13}{args.n / elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+CPU time and allocations per 10k search entries of ORM documents against DocumentRow records.
+
+- orm: a Document instance per entry, stored with save_bulk, the former
+  harvest path.
+- rows: DocumentRow records read directly from the entries, stored with a
+  Core insert by save_rows.
+
+The entries have the shape of COMPLETE view entries. Allocations are the
+memory blocks held by the 10k records once built, and the peak is the
+highest traced memory while they are built and stored. Run from the
+repository root:
+
+    PYTHONPATH=src:. python benchmarks/bench_rows.py
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from bench_projection import generated_entry
+
+from core.crud import SqlAlchemyORM
+from core.models import Document
+from core.parsing import document_row
+
+
+def build(method: str, entries: list):
+    if method == "orm":
+        return [Document(**document_row(e, "query", "Scopus")._asdict()) for e in entries]
+    return [document_row(e, "query", "Scopus") for e in entries]
+
+
+def store(method: str, orm: SqlAlchemyORM, records: list):
+    if method == "orm":
+        orm.save_bulk(records)
+    else:
+        orm.save_rows(records)
+
+
+def run(method: str, entries: list, tmp: str):
+    orm = SqlAlchemyORM(os.path.join(tmp, f"{method}.db"))
+    orm.db.create_database()
+    # Warm up the statement caches before measuring
+    store(method, orm, build(method, entries[:10]))
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = time.process_time()
+    records = build(method, entries[10:])
+    build_cpu = time.process_time() - start
+    held = tracemalloc.take_snapshot().compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in held)
+    size = sum(stat.size_diff for stat in held)
+
+    start = time.process_time()
+    store(method, orm, records)
+    store_cpu = time.process_time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    orm.db.engine.dispose()
+    return build_cpu, store_cpu, blocks, size, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", type=int, default=10000, help="Entries per run.")
+    args = parser.parse_args()
+
+    entries = [
+        dict(generated_entry(i % 100), eid=f"2-s2.0-{i}", **{"prism:doi": f"10.1/{i}"}) for i in range(args.n + 10)
+    ]
+    scale = 10000 / args.n
+    print(f"per 10k entries{'':<3}{'build ms':>10}{'store ms':>10}{'blocks':>10}{'held KB':>10}{'peak KB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for method in ("orm", "rows"):
+            build_cpu, store_cpu, blocks, size, peak = run(method, entries, tmp)
+            print(
+                f"{method:<18}{build_cpu * 1000 * scale:>10.0f}{store_cpu * 1000 * scale:>10.0f}"
+                f"{blocks * scale:>10.0f}{size * scale / 1024:>10.0f}{peak * scale / 1024:>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Documents per second of SqlAlchemyORM.save against SqlAlchemyORM.save_bulk.
+
+Run from the repository root:
+
+    PYTHONPATH=src:. python benchmarks/bench_save.py
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import date
+
+from core.crud import SqlAlchemyORM
+from core.models import Document
+
+
+def make_documents(n: int, offset: int = 0):
+    return [
+        Document(
+            title=f"Title {i}",
+            abstract="Abstract " * 50,
+            author=f"Author {i}",
+            published_date=date(2022, 1, 1),
+            doi=f"10.1000/{i}",
+            eid=f"2-s2.0-{i}",
+            affiliation_country="Spain",
+            search_query="bench",
+        )
+        for i in range(offset, offset + n)
+    ]
+
+
+def run(db_name: str, method: str, n: int, batch_size: int):
+    orm = SqlAlchemyORM(db_name)
+    orm.db.create_database()
+    documents = make_documents(n)
+    start = time.perf_counter()
+    if method == "save":
+        orm.save(documents)
+    else:
+        orm.save_bulk(documents, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    orm.db.engine.dispose()
+    return n / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", type=int, default=2000, help="Documents written per run.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Documents per bulk transaction.")
+    args = parser.parse_args()
+
+    print(f"{'database':<10}{'method':<12}{'docs/sec':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in ("memory", "disk"):
+            for method in ("save", "save_bulk"):
+                db_name = ":memory:" if label == "memory" else os.path.join(tmp, f"{method}.db")
+                rate = run(db_name, method, args.n, args.batch_size)
+                print(f"{label:<10}{method:<12}{rate:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Ingest and read throughput of the documents database for every engine profile.
+
+- ingest: documents per second stored with save_rows, one transaction per
+  --batch-size documents.
+- read: queries per second of --readers threads counting the documents by
+  country while one writer keeps ingesting, the documents per second the
+  writer stores meanwhile, and how many reads and writes failed with
+  "database is locked".
+
+Run from the repository root:
+
+    PYTHONPATH=src:. python benchmarks/bench_sqlite.py
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from bench_projection import generated_entry
+from sqlalchemy.exc import OperationalError
+
+from core.crud import SqlAlchemyORM
+from core.database import PROFILES, configure_database
+from core.parsing import document_row
+
+
+def make_rows(n: int, offset: int, entries: list):
+    return [
+        document_row(dict(entries[i % len(entries)], eid=f"2-s2.0-{i}", **{"prism:doi": f"10.1/{i}"}), "q", "Scopus")
+        for i in range(offset, offset + n)
+    ]
+
+
+def run(profile: str, args, entries: list, tmp: str):
+    configure_database(profile)
+    orm = SqlAlchemyORM(os.path.join(tmp, f"{profile}.db"))
+    orm.db.create_database()
+
+    rows = make_rows(args.documents, 0, entries)
+    start = time.perf_counter()
+    for i in range(0, len(rows), args.batch_size):
+        orm.save_rows(rows[i : i + args.batch_size], batch_size=args.batch_size)
+    ingest = len(rows) / (time.perf_counter() - start)
+
+    stop = threading.Event()
+    reads, written, locked = [0], [0], [0]
+    lock = threading.Lock()
+
+    def writer():
+        offset = args.documents
+        while not stop.is_set():
+            try:
+                orm.save_rows(make_rows(args.batch_size, offset, entries), batch_size=args.batch_size)
+                written[0] += args.batch_size
+            except OperationalError:
+                with lock:
+                    locked[0] += 1
+            offset += args.batch_size
+
+    def reader():
+        # Every reader has its own engine, like a plot or an enrichment job running next to the harvest
+        own = SqlAlchemyORM(os.path.join(tmp, f"{profile}.db"))
+        while not stop.is_set():
+            try:
+                own.get_documents_country()
+                with lock:
+                    reads[0] += 1
+            except OperationalError:
+                with lock:
+                    locked[0] += 1
+        own.db.close()
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(args.readers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    orm.db.close()
+    return ingest, reads[0] / args.seconds, written[0] / args.seconds, locked[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=20000, help="Documents ingested.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Documents per transaction.")
+    parser.add_argument("--readers", type=int, default=3, help="Threads reading while a writer ingests.")
+    parser.add_argument("--seconds", type=float, default=5, help="Duration of the concurrent reads.")
+    args = parser.parse_args()
+
+    entries = [generated_entry(i) for i in range(100)]
+    print(f"{'profile':<10}{'ingest docs/s':>15}{'reads/s':>10}{'writes docs/s':>15}{'locked':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in PROFILES:
+            ingest, reads, writes, locked = run(profile, args, entries, tmp)
+            print(f"{profile:<10}{ingest:>15.0f}{reads:>10.1f}{writes:>15.0f}{locked:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Peak memory and time of reading every abstract as a list against as a stream.
+
+- list: get_documents_id_abstract, the whole result in one list.
+- stream: iter_documents_id_abstract, --chunk-size rows fetched at a time
+  and consumed one by one, the way the plots count the countries.
+
+Run from the repository root:
+
+    PYTHONPATH=src:. python benchmarks/bench_stream.py
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from bench_projection import generated_entry
+
+from core.crud import SqlAlchemyORM
+from core.parsing import document_row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, nargs="+", default=[10000, 40000], help="Documents stored.")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Rows fetched at a time by the stream.")
+    args = parser.parse_args()
+
+    entries = [generated_entry(i) for i in range(100)]
+    print(f"{'documents':>10}  {'read':<8}{'ms':>8}{'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        orm = SqlAlchemyORM(os.path.join(tmp, "documents.db"), chunk_size=args.chunk_size)
+        orm.db.create_database()
+        stored = 0
+        for n in sorted(args.documents):
+            orm.save_rows(
+                document_row(dict(entries[i % len(entries)], eid=f"2-s2.0-{i}", **{"prism:doi": f"10.1/{i}"}), "q", "S")
+                for i in range(stored, n)
+            )
+            stored = n
+            for read in ("list", "stream"):
+                tracemalloc.start()
+                start = time.perf_counter()
+                if read == "list":
+                    total = sum(len(abstract or "") for _, abstract in orm.get_documents_id_abstract())
+                else:
+                    total = sum(len(abstract or "") for _, abstract in orm.iter_documents_id_abstract())
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                assert total
+                print(f"{n:>10}  {read:<8}{elapsed * 1000:>8.0f}{peak / 2**20:>10.1f}")
+        orm.db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Requests, bytes and harvest time of a one-phase against a two-phase harvest of overlapping queries.
+
+Every query of --queries matches --per-query documents of a shared pool, and
+consecutive queries share --overlap of them, the way the search terms of the
+Cartesian product do. The stub applies the view, count and field parameters
+like bench_projection and answers the EID(...) OR ... searches of the second
+phase. Run from the repository root:
+
+    PYTHONPATH=src:. python benchmarks/bench_two_phase.py
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from bench_projection import SearchStub, generated_entry, project
+
+from core.crud import SqlAlchemyORM
+from core.harvest import Harvester
+from core.ratelimit import AdaptiveRateLimiter
+from core.transport import configure_transport
+from tests.stub_server import StubServer
+
+
+class OverlapStub(SearchStub):
+    def __init__(self, entries: list, per_query: int, shift: int, latency: float, mbps: float):
+        super().__init__(entries, per_query, latency, mbps)
+        self.shift = shift
+
+    def __call__(self, method, path):
+        params = {k: v[-1] for k, v in parse_qs(urlsplit(path).query).items()}
+        view = params.get("view", "STANDARD")
+        count = min(int(params.get("count", 25)), 25 if view == "COMPLETE" else 200)
+        fields = params["field"].split(",") if "field" in params else None
+
+        links = []
+        if params["query"].startswith("EID("):
+            ids = [int(term[len("EID(2-s2.0-") : -1]) for term in params["query"].split(" OR ")]
+        else:
+            first = int(params["query"][1:]) * self.shift
+            start = 0 if params["cursor"] == "*" else int(params["cursor"])
+            ids = range(first + start, first + min(start + count, self.per_query))
+            if start + count < self.per_query:
+                params["cursor"] = str(start + count)
+                links.append({"@ref": "next", "@href": f"{self.url}/content/search/scopus?{urlencode(params)}"})
+        entries = []
+        for i in ids:
+            entry = dict(self.entries[i % len(self.entries)], eid=f"2-s2.0-{i}", **{"prism:doi": f"10.1/{i}"})
+            entries.append(project(entry, view, fields))
+        body = json.dumps({"search-results": {"entry": entries, "link": links}}).encode()
+
+        self.pages += 1
+        self.bytes += len(body)
+        time.sleep(self.latency + len(body) * 8 / (self.mbps * 1e6))
+        return 200, {"Content-Type": "application/json"}, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--queries", type=int, default=6, help="Queries harvested.")
+    parser.add_argument("--per-query", type=int, default=300, help="Results of every query.")
+    parser.add_argument("--overlap", type=float, default=0.6, help="Share of results of a query in the next one.")
+    parser.add_argument("--projection", default="fields", help="Projection of the full records.")
+    parser.add_argument("--latency-ms", type=float, default=150, help="Emulated latency of every page.")
+    parser.add_argument("--mbps", type=float, default=20, help="Emulated bandwidth.")
+    args = parser.parse_args()
+
+    os.environ.setdefault("ELSEVIER_API_KEY", "benchmark")
+    entries = [generated_entry(i) for i in range(100)]
+    queries = [f"q{i}" for i in range(args.queries)]
+    shift = max(1, round(args.per_query * (1 - args.overlap)))
+    configure_transport(pool_size=4)
+
+    print(f"{'harvest':<12}{'requests':>10}{'MB':>8}{'harvest s':>11}{'documents':>11}")
+    for two_phase in (False, True):
+        stub_route = OverlapStub(entries, args.per_query, shift, args.latency_ms / 1000, args.mbps)
+        with StubServer(stub_route) as stub, tempfile.TemporaryDirectory() as tmp:
+            stub_route.url = stub.url
+            orm = SqlAlchemyORM(os.path.join(tmp, "documents.db"))
+            orm.db.create_database()
+            h = Harvester(
+                lambda orm=orm: orm,
+                queries,
+                "2018-2022",
+                workers=4,
+                rate_limiter=AdaptiveRateLimiter(rate=1000, burst=100),
+                projection=args.projection,
+                api_url=stub.url,
+                two_phase=two_phase,
+            )
+            start = time.perf_counter()
+            inserted, _ = h.run()
+            elapsed = time.perf_counter() - start
+        print(
+            f"{'two-phase' if two_phase else 'one-phase':<12}{stub_route.pages:>10}"
+            f"{stub_route.bytes / 2**20:>8.1f}{elapsed:>11.2f}{inserted:>11}"
+        )
+
+
+if __name__ == "__main__":
+    main()
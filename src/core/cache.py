@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import sqlite3 as sl
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+LOGGER = logging.getLogger("systematic")
+
+# Path prefix of every Elsevier endpoint that can be cached
+ENDPOINTS = {
+    "search": "/content/search/",
+    "abstract": "/content/abstract/",
+    "author": "/content/author",
+    "serial": "/content/serial/title/",
+}
+
+
+class CacheMiss(requests.RequestException):
+    """
+    Raised in cache-only mode when a response is not cached.
+    """
+
+
+def strip_api_key(url: str):
+    # Remove the API key from a url before it is stored anywhere
+    base, _, query = url.partition("?")
+    params = [param for param in query.split("&") if param and not param.startswith("apiKey=")]
+    return f"{base}?{'&'.join(params)}" if params else base
+
+
+class ResponseCache:
+    """
+    On-disk cache of successful GET responses, stored zlib-compressed in a
+    SQLite file.
+
+    Entries are keyed by the SHA-256 of the url without its API key. Only the
+    endpoints with a TTL are cached, and the least recently used entries are
+    evicted once the bodies exceed max_bytes. In offline mode every response
+    must come from the cache.
+    """
+
+    def __init__(self, path: str = "http_cache.db", ttl: dict = None, max_bytes: int = 512 * 2**20, offline=False):
+        """
+        Constructor for the ResponseCache class.
+
+        Parameters:
+        - path: (str) SQLite file of the cache.
+        - ttl: (dict) Seconds an entry is fresh, by endpoint name of ENDPOINTS.
+        - max_bytes: (int) Maximum size of the compressed bodies.
+        - offline: (bool) Never go to the network, raise CacheMiss instead.
+        """
+        self._ttl = {ENDPOINTS[name]: seconds for name, seconds in (ttl or {}).items() if seconds}
+        self._max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._con = sl.connect(path, check_same_thread=False)
+        with self._con:
+            self._con.execute(
+                """CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY,
+                url TEXT NOT NULL, headers TEXT NOT NULL, body BLOB NOT NULL,
+                size INT NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL);"""
+            )
+            self._con.execute("CREATE INDEX IF NOT EXISTS ix_responses_accessed_at ON responses (accessed_at);")
+        self._size = self._con.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def ttl(self, url: str):
+        """
+        Seconds a response of the url stays fresh, None if it is not cached.
+        """
+        path = urlsplit(url).path
+        for prefix, seconds in self._ttl.items():
+            if path.startswith(prefix):
+                return seconds
+        return None
+
+    @staticmethod
+    def key(url: str):
+        return hashlib.sha256(strip_api_key(url).encode()).hexdigest()
+
+    def get(self, url: str):
+        """
+        Get the cached response of a url.
+
+        Returns:
+        - requests.Response object, or None if it is missing or stale.
+        """
+        ttl = self.ttl(url)
+        now = time.time()
+        with self._lock:
+            row = None
+            if ttl is not None:
+                row = self._con.execute(
+                    "SELECT headers, body, stored_at FROM responses WHERE key=?", (self.key(url),)
+                ).fetchone()
+            if row is None or now - row[2] > ttl:
+                if ttl is not None:
+                    self.misses += 1
+                if self.offline:
+                    raise CacheMiss(f"{strip_api_key(url)} is not cached")
+                return None
+            with self._con:
+                self._con.execute("UPDATE responses SET accessed_at=? WHERE key=?", (now, self.key(url)))
+            self.hits += 1
+
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(json.loads(row[0]))
+        response._content = zlib.decompress(row[1])
+        response.encoding = "utf-8"
+        response.from_cache = True
+        return response
+
+    def put(self, url: str, response):
+        """
+        Store a successful response of a cached endpoint.
+        """
+        if response.status_code != 200 or self.ttl(url) is None:
+            return
+        body = zlib.compress(response.content)
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in ("content-encoding", "content-length")}
+        now = time.time()
+        key = self.key(url)
+        with self._lock, self._con:
+            old = self._con.execute("SELECT size FROM responses WHERE key=?", (key,)).fetchone()
+            self._size += len(body) - (old[0] if old else 0)
+            self._con.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, strip_api_key(url), json.dumps(headers), body, len(body), now, now),
+            )
+            if self._size > self._max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop the least recently used entries until the bodies fit in max_bytes
+        rows = self._con.execute("SELECT key, size FROM responses ORDER BY accessed_at")
+        evicted = []
+        for key, size in rows:
+            if self._size <= self._max_bytes:
+                break
+            evicted.append((key,))
+            self._size -= size
+        if evicted:
+            self._con.executemany("DELETE FROM responses WHERE key=?", evicted)
+            LOGGER.info(f"{len(evicted)} responses evicted from the cache.")
+
+    def close(self):
+        self._con.close()
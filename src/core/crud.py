@@ -1,27 +1,82 @@
 import logging
+import threading
+from datetime import datetime, timedelta
 
-from sqlalchemy import func, select, update
+from sqlalchemy import bindparam, case, exists, func, literal_column, select, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import aliased
 
 from core.database import Database
 from core.models import (
+    AuthorProfile,
     Continent,
     Document,
+    DocumentQuery,
     DoiEurl,
     EissnPublisher,
+    FetchedEid,
+    HarvestCheckpoint,
     IssnImpact,
     IssnPublisher,
     Publisher,
+    PublisherEnrichment,
+    QueryCount,
     StudySelection,
 )
 
 LOGGER = logging.getLogger(__name__)
 
+# Columns written by save_bulk, the primary key is assigned by SQLite
+DOCUMENT_COLUMNS = [c.key for c in Document.__table__.columns if c.key != "id_document"]
+
+# Author details kept in the author profile store
+PROFILE_COLUMNS = ["document_count", "cited_by_count", "citation_count", "creation_date", "publication_range"]
+
+# Values bound per IN clause
+CHUNK_SIZE = 500
+
 
 class SqlAlchemyORM:
-    def __init__(self, db_name="documents.db"):
+    """
+    Store of the documents and of every cache of the enrichments.
+
+    It writes in bulk Core statements and reads either whole results or a
+    stream of rows. Its engine keeps one pool of connections, so a process
+    should share one store, see get_store.
+    """
+
+    def __init__(self, db_name="documents.db", chunk_size: int = 1000):
         self.db = Database(db_name)
+        # Rows fetched at a time by the streaming reads
+        self.chunk_size = chunk_size
+
+    def stream(self, statement, chunk_size: int = None):
+        # This function yields the rows of a select statement, fetching chunk_size rows at a time
+        # from the cursor instead of loading the whole result. The read stays open until the
+        # rows are consumed, so writes should wait for the end of the stream
+        with self.db.engine.connect() as conn:
+            yield from conn.execution_options(yield_per=chunk_size or self.chunk_size).execute(statement)
+
+    def stream_keyset(self, statement, column, chunk_size: int = None):
+        # This function yields the values of column selected by a statement in column order, reading
+        # chunk_size of them per query after the last one yielded. No read stays open between the
+        # pages, so the caller can write while it consumes them
+        chunk_size = chunk_size or self.chunk_size
+        statement = statement.order_by(column).limit(chunk_size)
+        last = None
+        while True:
+            with self.db.engine.connect() as conn:
+                values = conn.execute(statement if last is None else statement.where(column > last)).scalars().all()
+            yield from values
+            if len(values) < chunk_size:
+                return
+            last = values[-1]
+
+    def count(self, statement):
+        # This function counts the rows selected by a statement
+        with self.db.engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(statement.subquery())).scalar()
 
     def get_impact_by_issn(self, issn: str):
         # This function gets the impact by ISSN
@@ -79,11 +134,10 @@ class SqlAlchemyORM:
                 return None
 
     def set_publisher_by_issn(self, issn: str, publisher: str):
-        # This function sets the publisher by ISSN
-        with self.db.get_session() as sess:
-            issn_publisher = IssnPublisher(issn=issn, publisher=publisher)
-            sess.add(issn_publisher)
-            sess.commit()
+        # This function sets the publisher by ISSN, keeping the one already stored
+        stmt = sqlite_insert(IssnPublisher).values(issn=issn, publisher=publisher).on_conflict_do_nothing()
+        with self.db.engine.begin() as conn:
+            conn.execute(stmt)
 
     def get_publisher_by_eissn(self, eissn: str):
         # This function gets the publisher by EISSN
@@ -98,14 +152,14 @@ class SqlAlchemyORM:
                 return None
 
     def set_publisher_by_eissn(self, eissn: str, publisher: str):
-        # This function sets the publisher by EISSN
-        with self.db.get_session() as sess:
-            eissn_publisher = EissnPublisher(eissn=eissn, publisher=publisher)
-            sess.add(eissn_publisher)
-            sess.commit()
+        # This function sets the publisher by EISSN, keeping the one already stored
+        stmt = sqlite_insert(EissnPublisher).values(eissn=eissn, publisher=publisher).on_conflict_do_nothing()
+        with self.db.engine.begin() as conn:
+            conn.execute(stmt)
 
     def save(self, documents):
         # This function saves documents in the database
+        links = [(doc.eid, doc.search_query) for doc in documents if doc.eid and doc.search_query]
         with self.db.get_session() as sess:
             for doc in documents:
                 try:
@@ -115,6 +169,208 @@ class SqlAlchemyORM:
                 except IntegrityError:
                     LOGGER.warning("Failed to insert document, it already exists.")
                     sess.rollback()
+        self.save_links(links)
+
+    def save_bulk(self, documents, batch_size: int = 500):
+        # This function saves documents in batches, one transaction per batch,
+        # skipping the ones whose eid or doi are already stored.
+        # It returns how many documents were inserted and how many were skipped
+        rows = [{c: getattr(doc, c) for c in DOCUMENT_COLUMNS} for doc in documents]
+        return self._insert_documents(rows, batch_size)
+
+    def save_rows(self, rows, batch_size: int = 500, query_order: list = None):
+        # This function saves DocumentRow records like save_bulk, without creating ORM instances.
+        # With query_order, a document matched by several of those search queries keeps the first of them,
+        # whichever was saved first
+        return self._insert_documents([row._asdict() for row in rows], batch_size, query_order)
+
+    def _insert_documents(self, rows: list, batch_size: int, query_order: list = None):
+        # The documents and the search queries that matched them are committed together,
+        # so the links of the duplicates are kept too
+        stmt = sqlite_insert(Document.__table__).on_conflict_do_nothing()
+        link_stmt = sqlite_insert(DocumentQuery).on_conflict_do_nothing()
+        rank, rank_stmt = {}, None
+        if query_order:
+            # Documents stored by a search query outside query_order are left alone
+            rank = {search_query: i for i, search_query in enumerate(dict.fromkeys(query_order))}
+            rank_stmt = (
+                update(Document)
+                .where(
+                    Document.eid == bindparam("b_eid"),
+                    case(rank, value=Document.search_query, else_=-1) > bindparam("b_rank"),
+                )
+                .values(search_query=bindparam("b_search_query"))
+            )
+
+        inserted = 0
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start : start + batch_size]
+            links = [
+                {"eid": row["eid"], "search_query": row["search_query"]}
+                for row in batch
+                if row["eid"] and row["search_query"]
+            ]
+            # A document only moves to an earlier search query, so the links of the last one never move it
+            ranked = [
+                {"b_eid": link["eid"], "b_rank": rank[link["search_query"]], "b_search_query": link["search_query"]}
+                for link in links
+                if rank.get(link["search_query"], len(rank)) < len(rank) - 1
+            ]
+            with self.db.engine.begin() as conn:
+                inserted += conn.execute(stmt, batch).rowcount
+                if links:
+                    conn.execute(link_stmt, links)
+                if ranked:
+                    conn.execute(rank_stmt, ranked)
+
+        skipped = len(rows) - inserted
+        LOGGER.info(f"{inserted} documents inserted, {skipped} skipped as duplicates")
+        return inserted, skipped
+
+    def save_links(self, links, batch_size: int = 500):
+        # This function saves the (eid, search query) pairs of the documents matched by every search query,
+        # keeping the ones already stored. It returns how many links were inserted
+        stmt = sqlite_insert(DocumentQuery).on_conflict_do_nothing()
+        rows = [{"eid": eid, "search_query": search_query} for eid, search_query in links]
+
+        inserted = 0
+        for start in range(0, len(rows), batch_size):
+            with self.db.engine.begin() as conn:
+                inserted += conn.execute(stmt, rows[start : start + batch_size]).rowcount
+        return inserted
+
+    def get_unfetched_eids(self, query_order: list = None):
+        # This function gets the linked EIDs missing from the documents table and never requested,
+        # grouped by the first search query that matched them, in the order they were linked.
+        # With query_order, they are grouped by the first of those search queries that matched them instead
+        stmt = (
+            select(DocumentQuery.eid, DocumentQuery.search_query)
+            .where(
+                ~exists().where(Document.eid == DocumentQuery.eid),
+                ~exists().where(FetchedEid.eid == DocumentQuery.eid),
+            )
+            .order_by(literal_column("document_query.rowid"))
+        )
+        rank = {search_query: i for i, search_query in enumerate(dict.fromkeys(query_order or []))}
+        matched = {}
+        with self.db.engine.connect() as conn:
+            for eid, search_query in conn.execute(stmt):
+                if eid not in matched or rank.get(search_query, len(rank)) < rank.get(matched[eid], len(rank)):
+                    matched[eid] = search_query
+        unfetched = {}
+        for eid, search_query in matched.items():
+            unfetched.setdefault(search_query, []).append(eid)
+        return unfetched
+
+    def set_fetched_eids(self, eids):
+        # This function records the EIDs requested by the second phase of a two-phase harvest,
+        # so the ones that stored no document are not requested on every run
+        now = datetime.now()
+        rows = [{"eid": eid, "fetched_at": now} for eid in eids]
+        for start in range(0, len(rows), CHUNK_SIZE):
+            with self.db.engine.begin() as conn:
+                conn.execute(sqlite_insert(FetchedEid).on_conflict_do_nothing(), rows[start : start + CHUNK_SIZE])
+
+    def get_document_queries(self, eid: str):
+        # This function gets the search queries that matched a document
+        stmt = select(DocumentQuery.search_query).where(DocumentQuery.eid == eid).order_by(DocumentQuery.search_query)
+        with self.db.engine.connect() as conn:
+            return conn.execute(stmt).scalars().all()
+
+    def get_query_overlap(self):
+        # This function gets, per search query, the documents it matched, how many of them
+        # no other query matched and how many were matched by other queries too
+        stmt = text(
+            "SELECT search_query, matched, unique_documents, overlapping FROM query_overlap ORDER BY search_query"
+        )
+        with self.db.engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(stmt)]
+
+    def get_checkpoint(self, search_query: str, date_range: str):
+        # This function gets the harvest checkpoint of a search query
+        with self.db.get_session() as sess:
+            result = sess.get(HarvestCheckpoint, (search_query, str(date_range)))
+            if result:
+                return {
+                    "next_link": result.next_link,
+                    "pages": result.pages,
+                    "complete": result.complete,
+                }
+            else:
+                return None
+
+    def set_checkpoint(self, search_query: str, date_range: str, next_link: str, pages: int, complete: bool = False):
+        # This function stores the cursor of the last committed page of a search query
+        values = {
+            "next_link": next_link,
+            "pages": pages,
+            "complete": complete,
+            "updated_at": datetime.now(),
+        }
+        stmt = sqlite_insert(HarvestCheckpoint).values(search_query=search_query, date_range=str(date_range), **values)
+        stmt = stmt.on_conflict_do_update(index_elements=["search_query", "date_range"], set_=values)
+        with self.db.engine.begin() as conn:
+            conn.execute(stmt)
+
+    def get_query_counts(self, keys, max_age_days: int = None):
+        # This function gets the stored result counts of the given (search query, date range) pairs,
+        # leaving out the ones counted more than max_age_days ago
+        keys = {(s, str(d)) for s, d in keys}
+        counts = {}
+        with self.db.get_session() as sess:
+            query = sess.query(QueryCount.search_query, QueryCount.date_range, QueryCount.total)
+            query = query.filter(QueryCount.search_query.in_({s for s, _ in keys}))
+            if max_age_days is not None:
+                query = query.filter(QueryCount.counted_at >= datetime.now() - timedelta(days=max_age_days))
+            for search_query, date_range, total in query:
+                if (search_query, date_range) in keys:
+                    counts[(search_query, date_range)] = total
+        return counts
+
+    def set_query_counts(self, counts: dict):
+        # This function stores result counts, keyed by (search query, date range), replacing the previous ones
+        now = datetime.now()
+        rows = [
+            {"search_query": s, "date_range": str(d), "total": total, "counted_at": now}
+            for (s, d), total in counts.items()
+        ]
+        if not rows:
+            return
+        stmt = sqlite_insert(QueryCount)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["search_query", "date_range"],
+            set_={"total": stmt.excluded.total, "counted_at": stmt.excluded.counted_at},
+        )
+        with self.db.engine.begin() as conn:
+            conn.execute(stmt, rows)
+
+    def get_author_profiles(self, auids, max_age_days: int = None):
+        # This function gets the stored profiles of the given authors,
+        # leaving out the ones fetched more than max_age_days ago
+        auids = list(auids)
+        profiles = {}
+        with self.db.get_session() as sess:
+            for start in range(0, len(auids), CHUNK_SIZE):
+                query = sess.query(AuthorProfile).filter(AuthorProfile.auid.in_(auids[start : start + CHUNK_SIZE]))
+                if max_age_days is not None:
+                    query = query.filter(AuthorProfile.fetched_at >= datetime.now() - timedelta(days=max_age_days))
+                for row in query:
+                    profiles[row.auid] = {c: getattr(row, c) for c in PROFILE_COLUMNS}
+        return profiles
+
+    def set_author_profiles(self, profiles: dict):
+        # This function stores author profiles, keyed by auid, replacing the previous ones
+        now = datetime.now()
+        rows = [
+            {"auid": auid, "fetched_at": now, **{c: profile[c] for c in PROFILE_COLUMNS}}
+            for auid, profile in profiles.items()
+        ]
+        stmt = sqlite_insert(AuthorProfile)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["auid"], set_={c: stmt.excluded[c] for c in PROFILE_COLUMNS + ["fetched_at"]}
+        )
+        with self.db.engine.begin() as conn:
+            conn.execute(stmt, rows)
 
     def get_all_issn_without_publisher(self):
         # This function gets the documents with ISSN but without editor
@@ -152,22 +408,17 @@ class SqlAlchemyORM:
 
     def get_empty_publisher(self):
         # This function gets the documents without a publisher
-        with self.db.get_session() as sess:
-            result = (
-                sess.query(
-                    Document.id_document,
-                    Document.eid,
-                    Document.issn,
-                    Document.eissn,
-                )
-                .outerjoin(
-                    IssnPublisher,
-                    Document.issn.__eq__(IssnPublisher.issn),
-                )
-                .filter(IssnPublisher.publisher.is_(None))
-                .all()
-            )
-            return [(row[0], row[1], row[2]) for row in result]
+        return list(self.iter_empty_publisher())
+
+    def iter_empty_publisher(self, chunk_size: int = None):
+        # This function yields the id, eid, issn and eissn of the documents without a publisher
+        stmt = (
+            select(Document.id_document, Document.eid, Document.issn, Document.eissn)
+            .outerjoin(IssnPublisher, Document.issn.__eq__(IssnPublisher.issn))
+            .where(IssnPublisher.publisher.is_(None))
+        )
+        for row in self.stream(stmt, chunk_size):
+            yield tuple(row)
 
     def set_publisher(self, publishers):
         # This function sets the publisher for documents
@@ -201,28 +452,27 @@ class SqlAlchemyORM:
             return [(row[0]) for row in result]
 
     def set_continent(self, tuples):
-        # This function sets the continent for affiliated countries
-        with self.db.get_session() as sess:
-            try:
-                for tpl in tuples:
-                    continent = Continent(affiliation_country=tpl[0], continent=tpl[1])
-                    sess.add(continent)
-                sess.commit()
-                LOGGER.info("Continent inserted successfully")
-            except IntegrityError as error:
-                LOGGER.error(f"Failed to insert continent, {error}.")
-                exit(-1)
+        # This function sets the continent for affiliated countries in one bulk insert,
+        # leaving the countries that already have one as they are
+        rows = [{"affiliation_country": country, "continent": continent} for country, continent in tuples]
+        if rows:
+            with self.db.engine.begin() as conn:
+                conn.execute(sqlite_insert(Continent).on_conflict_do_nothing(), rows)
+        LOGGER.info(f"{len(rows)} continents inserted successfully")
 
     def get_doi(self):
         # This function gets documents with DOI without access URL
-        with self.db.get_session() as sess:
-            result = (
-                sess.query(Document.doi)
-                .outerjoin(DoiEurl, Document.doi.__eq__(DoiEurl.doi))
-                .filter(Document.doi.isnot(None), DoiEurl.eurl.is_(None))
-                .all()
-            )
-            return [(row[0]) for row in result]
+        return list(self.iter_doi())
+
+    def iter_doi(self, chunk_size: int = None):
+        # This function yields the DOI of the documents without access URL in DOI order, a page at a time,
+        # so the caller can store the access URLs while it consumes them
+        stmt = (
+            select(Document.doi)
+            .outerjoin(DoiEurl, Document.doi.__eq__(DoiEurl.doi))
+            .where(Document.doi.isnot(None), DoiEurl.eurl.is_(None))
+        )
+        return self.stream_keyset(stmt, Document.doi, chunk_size)
 
     def set_doi_eurl(self, doi: str, eurl: str):
         # This function sets the access URL for documents with DOI
@@ -231,38 +481,66 @@ class SqlAlchemyORM:
             sess.add(doi_eurl)
             sess.commit()
 
+    def set_doi_eurls(self, pairs):
+        # This function sets the access URL of many documents in one transaction,
+        # the pairs are (doi, eurl) tuples and DOIs already stored are left as they are
+        rows = [{"doi": doi, "eurl": eurl} for doi, eurl in pairs]
+        if rows:
+            with self.db.engine.begin() as conn:
+                conn.execute(sqlite_insert(DoiEurl).on_conflict_do_nothing(), rows)
+
+    def get_prefix_hosts(self):
+        # This function counts the stored access URLs by DOI prefix,
+        # returning (prefix, eurl, count) tuples
+        prefix = func.lower(func.substr(DoiEurl.doi, 1, func.instr(DoiEurl.doi, "/") - 1))
+        with self.db.get_session() as sess:
+            result = (
+                sess.query(prefix, DoiEurl.eurl, func.count())
+                .filter(func.instr(DoiEurl.doi, "/") > 0)
+                .group_by(prefix, DoiEurl.eurl)
+                .all()
+            )
+            return [(row[0], row[1], row[2]) for row in result]
+
     def get_empty_openaccess(self):
         # This function gets documents without openaccess
         # and with status 3 in StudySelection
-        with self.db.get_session() as sess:
-            subquery = sess.query(StudySelection.id_document).filter(StudySelection.status == 3).subquery()
+        return list(self.iter_empty_openaccess())
 
-            doc = aliased(Document)
+    def iter_empty_openaccess(self, chunk_size: int = None):
+        # This function yields the eid of the selected documents without openaccess in eid order, a page
+        # at a time, so the caller can store the openaccess while it consumes them
+        return self.stream_keyset(self._empty_openaccess(), Document.eid, chunk_size)
 
-            result = (
-                sess.query(doc.eid)
-                .join(
-                    subquery,
-                    doc.id_document.__eq__(subquery.scalar_subquery()),
-                )
-                .filter(doc.openaccess is None)
-                .all()
-            )
+    def count_empty_openaccess(self):
+        # This function counts the selected documents without openaccess
+        return self.count(self._empty_openaccess())
 
-            return [(row[0]) for row in result]
+    def _empty_openaccess(self):
+        return (
+            select(Document.eid)
+            .join(StudySelection, StudySelection.id_document.__eq__(Document.id_document))
+            .where(StudySelection.status == 3, Document.openaccess.is_(None))
+        )
 
     def set_openaccess(self, eid: str, openaccess: str):
         # This method updates the openaccess field of
         # a document in the database.
-        with self.db.get_session() as sess:
-            try:
-                stmt = update(Document).where(Document.eid.__eq__(eid)).values(openaccess=openaccess)
-                sess.execute(stmt)
-
-                LOGGER.info("Field openaccess updated successfully")
-            except Exception as error:
-                LOGGER.error(f"Failed to update openaccess, {error}.")
-                exit(-1)
+        self.set_openaccess_bulk([(eid, openaccess)])
+
+    def set_openaccess_bulk(self, pairs):
+        # This method updates the openaccess field of many documents
+        # with one executemany UPDATE, the pairs are (eid, openaccess) tuples
+        rows = [{"b_eid": eid, "b_openaccess": openaccess} for eid, openaccess in pairs]
+        if rows:
+            stmt = (
+                update(Document.__table__)
+                .where(Document.__table__.c.eid == bindparam("b_eid"))
+                .values(openaccess=bindparam("b_openaccess"))
+            )
+            with self.db.engine.begin() as conn:
+                conn.execute(stmt, rows)
+        LOGGER.info(f"Field openaccess updated successfully for {len(rows)} documents")
 
     def set_status_studyselection(self, document_id: int, status: int):
         # This method updates the status of the study selection
@@ -283,47 +561,149 @@ class SqlAlchemyORM:
 
     def get_documents_country(self):
         # This function gets the country value of every entry
-        with self.db.get_session() as sess:
-            result = sess.query(Document.affiliation_country).all()
-            return [(row[0]) for row in result]
+        return list(self.iter_documents_country())
+
+    def iter_documents_country(self, chunk_size: int = None):
+        # This function yields the country value of every entry
+        for row in self.stream(select(Document.affiliation_country), chunk_size):
+            yield row[0]
 
     def get_documents_eid(self):
         # This function gets the eid value of every document
-        with self.db.get_session() as sess:
-            result = sess.query(Document.eid).all()
-            return [(row[0]) for row in result]
+        return list(self.iter_documents_eid())
+
+    def iter_documents_eid(self, chunk_size: int = None):
+        # This function yields the eid value of every document
+        for row in self.stream(select(Document.eid), chunk_size):
+            yield row[0]
 
     def get_documents_id_abstract(self):
         # This function gets the relation between document abstract and it identificator
-        with self.db.get_session() as sess:
-            result = sess.query(Document.id_document, Document.abstract).all()
-            return [(row[0], row[1]) for row in result]
+        return list(self.iter_documents_id_abstract())
 
-    def get_documents_type(self):
-        with self.db.get_session() as sess:
-            result = (
-                sess.query(
-                    Document.sub_type,  # El tipo de documento
-                    func.count().label("cantidad"),  # Contar el número de documentos por tipo
-                )
-                .group_by(Document.sub_type)  # Agrupar por el tipo de documento
-                .all()  # Ejecutamos la consulta y obtenemos todos los resultados
-            )
+    def iter_documents_id_abstract(self, chunk_size: int = None):
+        # This function yields the identificator and abstract of every document
+        for row in self.stream(select(Document.id_document, Document.abstract), chunk_size):
+            yield (row[0], row[1])
 
-        return result
+    def get_documents_type(self):
+        # This function gets the number of documents of every type
+        return self.count_by_sub_type()
 
     def get_documents_year(self):
-        with self.db.get_session() as sess:
-            result = (
-                sess.query(
-                    func.substr(Document.published_date, 1, 4).label("año"),  # Extraer el año de la fecha
-                    func.count().label("cantidad"),  # Contar el número de documentos
-                )
-                .group_by(func.substr(Document.published_date, 1, 4))  # Agrupar por el año
-                .all()  # Ejecutamos la consulta y obtenemos todos los resultados
+        # This function gets the number of documents published every year
+        return self.count_by_year()
+
+    def _aggregate(self, statement):
+        with self.db.engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(statement)]
+
+    def count_by_country(self):
+        # This function counts the documents of every affiliation country, the most frequent first
+        documents = func.count().label("documents")
+        stmt = (
+            select(Document.affiliation_country, documents)
+            .where(Document.affiliation_country.isnot(None))
+            .group_by(Document.affiliation_country)
+            .order_by(documents.desc(), Document.affiliation_country)
+        )
+        return self._aggregate(stmt)
+
+    def count_by_continent(self):
+        # This function counts the documents of every continent, through the continent of their
+        # affiliation country. Countries missing from the continents table are left out
+        documents = func.count().label("documents")
+        stmt = (
+            select(Continent.continent, documents)
+            .select_from(Document)
+            .join(Continent, Document.affiliation_country.__eq__(Continent.affiliation_country))
+            .group_by(Continent.continent)
+            .order_by(documents.desc(), Continent.continent)
+        )
+        return self._aggregate(stmt)
+
+    def count_by_year(self):
+        # This function counts the documents published every year, in year order
+        year = func.substr(Document.published_date, 1, 4).label("year")
+        stmt = select(year, func.count().label("documents")).group_by(year).order_by(year)
+        return self._aggregate(stmt)
+
+    def count_by_sub_type(self):
+        # This function counts the documents of every type, the most frequent first
+        documents = func.count().label("documents")
+        stmt = (
+            select(Document.sub_type, documents)
+            .group_by(Document.sub_type)
+            .order_by(documents.desc(), Document.sub_type)
+        )
+        return self._aggregate(stmt)
+
+    def count_by_publisher(self):
+        # This function counts the documents of every publisher, known by the ISSN or else the EISSN
+        # of their journal, the most frequent first
+        publisher = func.coalesce(IssnPublisher.publisher, EissnPublisher.publisher).label("publisher")
+        documents = func.count().label("documents")
+        stmt = (
+            select(publisher, documents)
+            .select_from(Document)
+            .outerjoin(IssnPublisher, Document.issn.__eq__(IssnPublisher.issn))
+            .outerjoin(EissnPublisher, Document.eissn.__eq__(EissnPublisher.eissn))
+            .where(publisher.isnot(None))
+            .group_by(publisher)
+            .order_by(documents.desc(), publisher)
+        )
+        return self._aggregate(stmt)
+
+    def get_eids_without_publisher(self):
+        # This function gets the eid of the documents not enriched yet, neither marked as enriched nor
+        # with any publisher row, as the ones enriched before the marker, so an interrupted
+        # enrichment resumes where it stopped
+        return list(self.iter_eids_without_publisher())
+
+    def iter_eids_without_publisher(self, chunk_size: int = None):
+        # This function yields the eid of the documents not enriched yet in eid order, a page at a time,
+        # so the caller can insert the publishers while it consumes them
+        return self.stream_keyset(self._eids_without_publisher(), Document.eid, chunk_size)
+
+    def count_eids_without_publisher(self):
+        # This function counts the documents not enriched yet
+        return self.count(self._eids_without_publisher())
+
+    def _eids_without_publisher(self):
+        return (
+            select(Document.eid)
+            .outerjoin(PublisherEnrichment, Document.eid.__eq__(PublisherEnrichment.eid))
+            .where(
+                Document.eid.isnot(None),
+                PublisherEnrichment.eid.is_(None),
+                ~exists().where(Publisher.id_document == Document.eid),
             )
-
-        return result
+        )
+
+    def insert_publishers(self, eid: str, authors: list):
+        # This function inserts every author of a document and marks the document as enriched
+        # in a single transaction, the authors are dicts with the complete_name and the author details
+        rows = [
+            {
+                "id_document": eid,
+                "complete_name": author["complete_name"],
+                "auid": author["auid"],
+                "document_number": author["document_count"],
+                "cited_by_count": author["cited_by_count"],
+                "citation_count": author["citation_count"],
+                "creation_date": author["creation_date"],
+                "publication_range": author["publication_range"],
+                "country": author["country"],
+                "city": author["city"],
+            }
+            for author in authors
+        ]
+        marker = {"eid": eid, "authors": len(rows), "enriched_at": datetime.now()}
+        with self.db.engine.begin() as conn:
+            if rows:
+                conn.execute(Publisher.__table__.insert(), rows)
+            conn.execute(sqlite_insert(PublisherEnrichment).values(marker).on_conflict_do_nothing())
+        return len(rows)
 
     def insert_publisher(self, eid: str, complete_name: str, author: dict):
         # This function inserts a publisher in the database
@@ -346,3 +726,35 @@ class SqlAlchemyORM:
 
         # Confirmar la transacción (commit)
         sess.commit()
+
+
+# Store shared by every thread of the process
+_store = None
+_store_lock = threading.Lock()
+
+
+def configure_store(db_name: str = "documents.db", chunk_size: int = 1000):
+    """
+    Replace the process-wide store, e.g. with an in-memory one.
+
+    Parameters:
+    - db_name: (str) Name of the database file, or ":memory:".
+    - chunk_size: (int) Rows fetched at a time by the streaming reads.
+    """
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.db.close()
+        _store = SqlAlchemyORM(db_name, chunk_size=chunk_size)
+        return _store
+
+
+def get_store():
+    """
+    Get the process-wide store, creating it on first use.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SqlAlchemyORM()
+        return _store
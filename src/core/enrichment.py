@@ -0,0 +1,224 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+from core.scopus import Scopus
+
+LOGGER = logging.getLogger("systematic")
+
+
+def complete_name(author: dict):
+    # Join the given name and the surname of an author, either of them may be missing
+    names = [name for name in (author.get("given_name"), author.get("surname")) if name is not None]
+    return " ".join(names) if names else None
+
+
+class PublisherEnricher:
+    """
+    Fill the publisher table with the authors of every stored document.
+
+    Only the documents not enriched yet are fetched, and the authors of a
+    document are inserted in one transaction together with the mark of the
+    document as enriched, so an interrupted run resumes with the documents
+    that were not committed, and documents without authors are not fetched
+    again. The authors are fetched by a pool of workers that share the
+    Scopus rate limiter, while the inserts are made by the calling thread.
+    The documents are read from the store a page at a time as they are
+    submitted, with a few of them in flight per worker.
+
+    With prefetch_authors, the authors of prefetch_window documents are
+    collected first and each distinct profile missing from the author store
+    is fetched once, before the inserts of those documents.
+    """
+
+    def __init__(
+        self,
+        store,
+        scopus: Scopus,
+        workers: int = 4,
+        progress_every: int = 50,
+        prefetch_authors: bool = False,
+        prefetch_window: int = 1000,
+    ):
+        """
+        Constructor for the PublisherEnricher class.
+
+        Parameters:
+        - store: (SqlAlchemyORM) Store of the documents and the publishers.
+        - scopus: (Scopus) Client used to fetch the authors of the documents.
+        - workers: (int) Documents fetched at the same time.
+        - progress_every: (int) Documents between progress messages.
+        - prefetch_authors: (bool) Collect the authors of the documents first and fetch each profile once.
+        - prefetch_window: (int) Documents whose authors are collected before their profiles are fetched.
+        """
+        self._store = store
+        self._scopus = scopus
+        self._workers = max(1, workers)
+        self._progress_every = progress_every
+        self._prefetch_authors = prefetch_authors
+        self._prefetch_window = max(1, prefetch_window)
+        self._prefetched = {}
+        self.documents = 0
+        self.authors = 0
+        self.failed = 0
+
+    def _prefetch(self, eids: list):
+        # Collect the authors of every document, then fetch the distinct profiles missing from the author store.
+        # Documents whose authors could not be collected are fetched as usual afterwards
+        def collect(eid):
+            try:
+                return self._scopus.get_authors_by_eid(eid)
+            except Exception as error:
+                LOGGER.warning(f"Error={error} collecting the authors of {eid}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="enrich-publisher") as pool:
+            for eid, authors in zip(eids, pool.map(collect, eids), strict=True):
+                if authors is not None:
+                    self._prefetched[eid] = authors
+        auids = {author["auid"] for authors in self._prefetched.values() for author in authors}
+        self._scopus.prefetch_author_profiles(auids)
+
+    def _prefetched_windows(self, eids):
+        # Prefetch the authors of the documents a window at a time, right before the window is enriched
+        eids = iter(eids)
+        while window := list(islice(eids, self._prefetch_window)):
+            self._prefetch(window)
+            yield from window
+
+    def _fetch(self, eid: str):
+        if eid in self._prefetched:
+            authors = self._prefetched.pop(eid)
+            authors = authors and self._scopus.extend_authors_info(auth_list=authors)
+        else:
+            authors = self._scopus.get_publishers_by_eid(eid) or []
+        rows = []
+        for author in authors:
+            name = complete_name(author)
+            if name is None or "document_count" not in author:
+                LOGGER.warning(f"Author {author.get('auid')} of {eid} has no name or profile, skipping it.")
+                continue
+            rows.append({**author, "complete_name": name})
+        return rows
+
+    def _progress(self, total: int, start: float):
+        minutes = (time.perf_counter() - start) / 60
+        rate = self.documents / minutes if minutes else 0.0
+        LOGGER.info(
+            f"Publisher enrichment {self.documents}/{total} documents, {self.authors} authors, "
+            f"{self.failed} failed, {rate:.1f} docs/min"
+        )
+
+    def run(self):
+        """
+        Enrich every document without publishers.
+
+        Returns:
+        - Tuple with the number of enriched documents and inserted authors.
+        """
+        total = self._store.count_eids_without_publisher()
+        LOGGER.info(f"{total} documents without publishers.")
+        start = time.perf_counter()
+        pending = self._store.iter_eids_without_publisher()
+        if self._prefetch_authors:
+            pending = self._prefetched_windows(pending)
+
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="enrich-publisher") as pool:
+            # Keep a few documents in flight per worker, so an interruption loses little work
+            futures = {pool.submit(self._fetch, eid): eid for eid in islice(pending, self._workers * 2)}
+            try:
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        eid = futures.pop(future)
+                        try:
+                            self.authors += self._store.insert_publishers(eid, future.result())
+                        except Exception as error:
+                            self.failed += 1
+                            LOGGER.error(f"Error={error} enriching the publishers of {eid}")
+                        self.documents += 1
+                        if self.documents % self._progress_every == 0:
+                            self._progress(total, start)
+                    for eid in list(islice(pending, len(done))):
+                        futures[pool.submit(self._fetch, eid)] = eid
+            except BaseException:
+                pool.shutdown(wait=True, cancel_futures=True)
+                raise
+
+        self._progress(total, start)
+        return self.documents - self.failed, self.authors
+
+
+class OpenAccessEnricher:
+    """
+    Fill the openaccess field of the selected documents.
+
+    The documents are asked in batches of batch_size EIDs, each batch with a
+    single search request restricted to the eid and openaccess fields, by a
+    pool of workers that share the Scopus rate limiter. Every batch is
+    written back with one UPDATE executed for all its documents, so an
+    interrupted run resumes with the batches that were not committed. The
+    documents are read from the store a page at a time as the batches are
+    submitted, with a few batches in flight per worker.
+    """
+
+    def __init__(self, store, scopus: Scopus, workers: int = 4, batch_size: int = 25):
+        """
+        Constructor for the OpenAccessEnricher class.
+
+        Parameters:
+        - store: (SqlAlchemyORM) Store of the documents.
+        - scopus: (Scopus) Client used to fetch the open access status.
+        - workers: (int) Batches fetched at the same time.
+        - batch_size: (int) EIDs per request, the search API returns at most 25 entries per page.
+        """
+        self._store = store
+        self._scopus = scopus
+        self._workers = max(1, workers)
+        self._batch_size = max(1, min(batch_size, 25))
+        self.documents = 0
+        self.failed = 0
+
+    def run(self):
+        """
+        Enrich every selected document without openaccess.
+
+        Returns:
+        - Number of updated documents.
+        """
+        total = self._store.count_empty_openaccess()
+        LOGGER.info(f"{total} documents without openaccess.")
+        start = time.perf_counter()
+        eids = self._store.iter_empty_openaccess()
+        batches = iter(lambda: list(islice(eids, self._batch_size)), [])
+
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="enrich-openaccess") as pool:
+            futures = {
+                pool.submit(self._scopus.get_openaccess_by_eids, batch): batch
+                for batch in islice(batches, self._workers * 2)
+            }
+            try:
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        batch = futures.pop(future)
+                        try:
+                            openaccess = future.result()
+                            self._store.set_openaccess_bulk(openaccess.items())
+                            self.documents += len(openaccess)
+                        except Exception as error:
+                            self.failed += len(batch)
+                            LOGGER.error(f"Error={error} enriching the openaccess of {batch}")
+                        minutes = (time.perf_counter() - start) / 60
+                        LOGGER.info(
+                            f"Openaccess enrichment {self.documents}/{total} documents, {self.failed} failed, "
+                            f"{self.documents / minutes if minutes else 0.0:.1f} docs/min"
+                        )
+                    for batch in list(islice(batches, len(done))):
+                        futures[pool.submit(self._scopus.get_openaccess_by_eids, batch)] = batch
+            except BaseException:
+                pool.shutdown(wait=True, cancel_futures=True)
+                raise
+
+        return self.documents
@@ -0,0 +1,347 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.ratelimit import AdaptiveRateLimiter
+from core.scopus import PROJECTIONS, Scopus
+
+LOGGER = logging.getLogger("systematic")
+
+# Marks the end of a stream of pages
+_DONE = object()
+
+
+class StageStats:
+    """
+    Counters of a pipeline stage: items processed, seconds spent working
+    and seconds blocked on its input or output queue.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items: int = 0, busy: float = 0.0, blocked: float = 0.0):
+        with self._lock:
+            self.items += items
+            self.busy += busy
+            self.blocked += blocked
+
+    def __str__(self):
+        return f"{self.name}: {self.items} items, {self.busy:.2f}s busy, {self.blocked:.2f}s blocked"
+
+
+class Harvester:
+    """
+    Fetch several Scopus search queries at the same time.
+
+    The harvest is a pipeline of two stages joined by a bounded queue, so a
+    slow writer holds the fetches back instead of piling up pages:
+
+    - fetch: one worker per query cursor requests the pages and decodes the
+      JSON into DocumentRow records as it arrives, all of them drawing from
+      one shared rate limiter. The link to the next page of a cursor is in
+      the page itself, so the worker that fetched a page decodes it.
+    - write: takes the pages of every query in the order they arrive,
+      stores the rows in bulk Core inserts of at least batch_size documents
+      and checkpoints the cursors. No ORM instance is created.
+
+    Pages are written in the order they arrive, so a long query does not
+    hold the cursors of the others back. The pages of a query keep their
+    order, so its checkpoint never moves past a page that is not committed.
+    A document matched by several queries is stored with the first of them
+    in the order of the queries, as a sequential harvest would, whatever
+    page is written first, and document_query links it to all of them.
+    Instead of every query over date_range, the harvest can run the shards
+    of a QueryPlan, each a query over its own date range.
+
+    With two_phase, the pipeline first runs with the EIDs alone, in pages of
+    200, and stores which search queries matched every document. Then only
+    the documents not stored yet are fetched in the projection of the harvest,
+    a page of EIDs per search request, so documents matched by several
+    queries are downloaded once. The EIDs requested are recorded, so the ones
+    that store no document, e.g. a DOI already stored under another EID, are
+    not requested again. A harvest interrupted in the second phase is
+    finished by running it again with two_phase.
+    """
+
+    def __init__(
+        self,
+        persistence,
+        search_queries: list,
+        date_range: str,
+        workers: int = 4,
+        rate_limiter: AdaptiveRateLimiter = None,
+        buffered_pages: int = 16,
+        batch_size: int = 500,
+        projection: str = "complete",
+        api_url: str = "https://api.elsevier.com",
+        parser: str = None,
+        shards: list = None,
+        two_phase: bool = False,
+    ):
+        """
+        Constructor for the Harvester class.
+
+        Parameters:
+        - persistence: Persistence class used to store the documents.
+        - search_queries: (list) Search queries, in the order they are written.
+        - date_range: (str) Year range of the search, e.g. "2018-2022".
+        - workers: (int) Number of query cursors fetched at the same time.
+        - rate_limiter: (AdaptiveRateLimiter) Shared limiter, defaults to Scopus.rate_limiter.
+        - buffered_pages: (int) Capacity, in pages, of the queues between stages.
+        - batch_size: (int) Documents written per transaction.
+        - projection: (str) Projection of the search results, one of scopus.PROJECTIONS.
+        - api_url: (str) Base url of the Elsevier API.
+        - parser: (str) Parser of the search pages, stream or loads, the fastest installed by default.
+        - shards: (list) (search query, date range) pairs harvested instead of the search queries, e.g. a QueryPlan.
+        - two_phase: (bool) Collect the EIDs of every query first and fetch each unseen document once.
+        """
+        self._persistence = persistence
+        self._date_range = str(date_range)
+        self._shards = [(shard[0], str(shard[1])) for shard in shards] if shards is not None else None
+        if self._shards is None:
+            self._shards = [(s, str(date_range)) for s in search_queries]
+        # Documents matched by several queries are stored with the first of them, as in a sequential harvest
+        self._query_order = list(dict.fromkeys(s for s, _ in self._shards))
+        self._workers = max(1, workers)
+        self._rate_limiter = rate_limiter or Scopus.rate_limiter
+        self._buffered_pages = buffered_pages
+        self._batch_size = batch_size
+        self._projection = projection
+        self._api_url = api_url
+        self._parser = parser
+        self._two_phase = two_phase
+        self._eids_only = False
+        self._stop = threading.Event()
+        self._checkpoints = {}
+        self._fetched = []
+        self.stats = {name: StageStats(name) for name in ("fetch", "write")}
+        self.inserted = 0
+        self.skipped = 0
+        self.matched = 0
+        self.linked = 0
+
+    def _put(self, stage: StageStats, pages: queue.Queue, item):
+        # Wait for the next stage, unless the harvest has been aborted
+        start = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    pages.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            stage.add(blocked=time.perf_counter() - start)
+
+    def _get(self, stage: StageStats, pages: queue.Queue):
+        # Wait for the previous stage, unless the harvest has been aborted
+        start = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    return pages.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+            return _DONE
+        finally:
+            stage.add(blocked=time.perf_counter() - start)
+
+    def _fetch(self, task: int, q: Scopus, next_link: str, pages: queue.Queue):
+        stage = self.stats["fetch"]
+        try:
+            next_link = next_link or (q.eids_link() if self._eids_only else q.first_link())
+            while next_link:
+                start = time.perf_counter()
+                rows, next_link = q.fetch_rows(next_link)
+                stage.add(items=1, busy=time.perf_counter() - start)
+
+                if not rows:
+                    break
+                if not self._put(stage, pages, (task, (rows, next_link))):
+                    return
+        finally:
+            self._put(stage, pages, (task, _DONE))
+
+    def _write_pages(self, p, tasks: list, futures: list, pages: queue.Queue):
+        # Write the pages of every query in the order they arrive, tracking the cursor of every query
+        done = [done for _, _, _, done in tasks]
+        running = len(tasks)
+        started = set()
+        batch = []
+        while running:
+            item = self._get(self.stats["write"], pages)
+            if item is _DONE:
+                return
+            task, page = item
+            shard, q = tasks[task][:2]
+            if shard not in started:
+                started.add(shard)
+                LOGGER.info(f"Processing {shard[0]} in {shard[1]}")
+            if page is _DONE:
+                running -= 1
+                # Raise the error of the fetch stage, if any
+                futures[task].result()
+                self._checkpoints[shard] = (None, done[task], True)
+                continue
+
+            rows, next_link = page
+            done[task] += 1
+            batch.extend(rows)
+            if next_link:
+                self._checkpoints[shard] = (q.strip_api_key(next_link), done[task], False)
+            if len(batch) >= self._batch_size:
+                self._write(p, batch)
+                batch = []
+        self._write(p, batch)
+
+    def _write(self, p, batch: list):
+        start = time.perf_counter()
+        if batch and self._eids_only:
+            self.linked += p.save_links([(row.eid, row.search_query) for row in batch], batch_size=len(batch))
+            self.matched += len(batch)
+        elif batch:
+            inserted, skipped = p.save_rows(batch, batch_size=len(batch), query_order=self._query_order)
+            self.inserted += inserted
+            self.skipped += skipped
+
+        # Checkpoints only move forward once their pages are committed
+        for shard, (next_link, pages, complete) in self._checkpoints.items():
+            p.set_checkpoint(*self._checkpoint_key(shard), next_link, pages, complete)
+        self._checkpoints.clear()
+        # And the EIDs of the second phase are only done once their documents are committed
+        if self._fetched:
+            p.set_fetched_eids(self._fetched)
+            self._fetched = []
+        self.stats["write"].add(items=len(batch), busy=time.perf_counter() - start)
+
+    def _checkpoint_key(self, shard: tuple):
+        # The EIDs of the first phase are checkpointed apart from the full records of a one-phase harvest,
+        # so a query already harvested without its links is still linked
+        search_query, date_range = shard
+        return (search_query, f"{date_range} eids") if self._eids_only else (search_query, date_range)
+
+    def run(self):
+        """
+        Harvest every search query and store the documents.
+
+        Queries already completed are skipped, and interrupted ones resume
+        after the last page that was committed.
+
+        Returns:
+        - Tuple with the number of inserted and duplicated documents.
+        """
+        p = self._persistence()
+        if self._two_phase:
+            self._eids_only = True
+            try:
+                self._harvest(p)
+            finally:
+                self._eids_only = False
+            self._fetch_unseen(p)
+        else:
+            self._harvest(p)
+
+        for stage in self.stats.values():
+            LOGGER.info(f"Harvest stage {stage}")
+        LOGGER.info(f"Harvest finished, {self.inserted} documents inserted and {self.skipped} duplicates skipped.")
+        return self.inserted, self.skipped
+
+    def _fetch_unseen(self, p):
+        # Second phase of a two-phase harvest, the documents linked to a search query but not stored yet
+        unfetched = p.get_unfetched_eids(query_order=self._query_order)
+        page_size = PROJECTIONS[self._projection][1]
+        batches = []
+        for s, eids in unfetched.items():
+            q = Scopus(
+                persistence=self._persistence,
+                search_query=s,
+                date_range=None,
+                rate_limiter=self._rate_limiter,
+                projection=self._projection,
+                api_url=self._api_url,
+                parser=self._parser,
+            )
+            batches.extend((q, eids[start : start + page_size]) for start in range(0, len(eids), page_size))
+        LOGGER.info(
+            f"{self.matched} matches and {self.linked} new links, "
+            f"fetching {sum(len(eids) for eids in unfetched.values())} unseen documents."
+        )
+
+        def fetch(task):
+            q, eids = task
+            start = time.perf_counter()
+            rows = q.fetch_eids(eids)
+            self.stats["fetch"].add(items=1, busy=time.perf_counter() - start)
+            return eids, rows
+
+        batch = []
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="harvest-fetch") as pool:
+            # Requests are sent a window at a time, so the fetched rows never pile up ahead of the writes
+            for start in range(0, len(batches), self._buffered_pages):
+                for eids, rows in pool.map(fetch, batches[start : start + self._buffered_pages]):
+                    batch.extend(rows)
+                    self._fetched.extend(eids)
+                    if len(batch) >= self._batch_size:
+                        self._write(p, batch)
+                        batch = []
+            self._write(p, batch)
+
+    def _resumed_shards(self, p):
+        # A query split into shards after being harvested, or partly harvested, over the whole date range
+        # keeps its checkpoint of the whole date range instead of restarting every shard from page one
+        resumed = set()
+        for s in {s for s, date_range in self._shards if date_range != self._date_range}:
+            started = [
+                shard for shard in self._shards if shard[0] == s and p.get_checkpoint(*self._checkpoint_key(shard))
+            ]
+            if not started and p.get_checkpoint(*self._checkpoint_key((s, self._date_range))):
+                LOGGER.info(f"Query {s} was harvested in {self._date_range} before being split, resuming it.")
+                resumed.add(s)
+
+        shards = []
+        for s, date_range in self._shards:
+            shard = (s, self._date_range) if s in resumed else (s, date_range)
+            if shard not in shards:
+                shards.append(shard)
+        return shards
+
+    def _harvest(self, p):
+        tasks = []
+        for s, date_range in self._resumed_shards(p):
+            checkpoint = p.get_checkpoint(*self._checkpoint_key((s, date_range)))
+            if checkpoint and checkpoint["complete"]:
+                LOGGER.info(f"Query {s} in {date_range} already harvested, skipping it.")
+                continue
+            q = Scopus(
+                persistence=self._persistence,
+                search_query=s,
+                date_range=date_range,
+                rate_limiter=self._rate_limiter,
+                projection=self._projection,
+                api_url=self._api_url,
+                parser=self._parser,
+            )
+            next_link, done = None, 0
+            if checkpoint and checkpoint["next_link"]:
+                next_link, done = q.add_api_key(checkpoint["next_link"]), checkpoint["pages"]
+            tasks.append(((s, date_range), q, next_link, done))
+
+        pages = queue.Queue(maxsize=self._buffered_pages)
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="harvest-fetch") as pool:
+            futures = [
+                pool.submit(self._fetch, task, q, next_link, pages) for task, (_, q, next_link, _) in enumerate(tasks)
+            ]
+            try:
+                self._write_pages(p, tasks, futures, pages)
+            except BaseException:
+                self._stop.set()
+                pool.shutdown(wait=True, cancel_futures=True)
+                raise
@@ -0,0 +1,83 @@
+"""
+Schema changes of the databases created by older versions.
+
+The tables missing from a database are created from the models, which
+already have every column and index. The migrations bring the rest of an
+existing database up to date. The version of a database is kept in
+PRAGMA user_version, and every migration runs once, in order, and bumps it.
+The statements are idempotent, so a migration interrupted halfway is run
+again as a whole.
+"""
+
+import logging
+
+LOGGER = logging.getLogger("systematic")
+
+# Version, description and statements of every migration, in order
+MIGRATIONS = [
+    (
+        1,
+        "Links of the documents stored before the document_query table and the query_overlap view",
+        [
+            "INSERT OR IGNORE INTO document_query (eid, search_query) "
+            "SELECT eid, search_query FROM documents WHERE eid IS NOT NULL AND search_query IS NOT NULL",
+            "CREATE VIEW IF NOT EXISTS query_overlap AS "
+            "SELECT link.search_query AS search_query, COUNT(*) AS matched, "
+            "SUM(matches.queries = 1) AS unique_documents, SUM(matches.queries > 1) AS overlapping "
+            "FROM document_query AS link "
+            "JOIN (SELECT eid, COUNT(*) AS queries FROM document_query GROUP BY eid) AS matches "
+            "ON matches.eid = link.eid "
+            "GROUP BY link.search_query",
+        ],
+    ),
+    (
+        2,
+        "Secondary indexes of the enrichment anti-joins and the plot aggregates",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_documents_affiliation_country ON documents (affiliation_country)",
+            "CREATE INDEX IF NOT EXISTS ix_documents_published_date ON documents (published_date)",
+            "CREATE INDEX IF NOT EXISTS ix_documents_sub_type ON documents (sub_type)",
+            "CREATE INDEX IF NOT EXISTS ix_studyselection_id_document ON studyselection (id_document)",
+            "CREATE INDEX IF NOT EXISTS ix_publisher_id_document ON publisher (id_document)",
+        ],
+    ),
+]
+
+# Version of the databases with every migration applied
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    """
+    Version of the schema of a database.
+
+    Parameters:
+    - conn: SQLAlchemy connection to the database.
+    """
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def migrate(engine):
+    """
+    Apply the migrations newer than the version of a database.
+
+    Parameters:
+    - engine: SQLAlchemy engine of the database, whose tables already exist.
+
+    Returns:
+    - List with the versions applied.
+    """
+    with engine.connect() as conn:
+        version = schema_version(conn)
+
+    applied = []
+    for number, description, statements in MIGRATIONS:
+        if number <= version:
+            continue
+        LOGGER.info(f"Migrating the database to version {number}: {description}")
+        with engine.begin() as conn:
+            for statement in statements:
+                conn.exec_driver_sql(statement)
+            conn.exec_driver_sql(f"PRAGMA user_version = {number}")
+        applied.append(number)
+    return applied
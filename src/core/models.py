@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Date, Float, ForeignKey, Integer, String
+from sqlalchemy import Boolean, Column, Date, DateTime, Float, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -7,7 +7,7 @@ Base = declarative_base()
 class Publisher(Base):
     __tablename__ = "publisher"
     publisher_id = Column(Integer, primary_key=True)
-    id_document = Column(String, nullable=False)
+    id_document = Column(String, nullable=False, index=True)
     complete_name = Column(String, nullable=False)
     auid = Column(String, primary_key=False)
     document_number = Column(Integer, nullable=False)
@@ -19,6 +19,17 @@ class Publisher(Base):
     city = Column(String, nullable=False)
 
 
+class AuthorProfile(Base):
+    __tablename__ = "author_profile"
+    auid = Column(String, primary_key=True)
+    document_count = Column(Integer)
+    cited_by_count = Column(Integer)
+    citation_count = Column(Integer)
+    creation_date = Column(String)
+    publication_range = Column(String)
+    fetched_at = Column(DateTime, nullable=False)
+
+
 class IssnPublisher(Base):
     __tablename__ = "issn_publisher"
     issn = Column(String, primary_key=True)
@@ -49,17 +60,17 @@ class Document(Base):
     abstract = Column(String)
     keywords = Column(String)
     author = Column(String)
-    published_date = Column(Date)
+    published_date = Column(Date, index=True)
     doi = Column(String, unique=True)
     eid = Column(String, unique=True)
     publication_name = Column(String)
     issn = Column(String)
     eissn = Column(String)
     type = Column(String)
-    sub_type = Column(String)
+    sub_type = Column(String, index=True)
     search_query = Column(String)
     source = Column(String)
-    affiliation_country = Column(String)
+    affiliation_country = Column(String, index=True)
     citedby_count = Column(Integer)
     openaccess = Column(String)
     study_selection = relationship("StudySelection")
@@ -120,5 +131,47 @@ class StudySelection(Base):
     __tablename__ = "studyselection"
     id = Column(Integer, primary_key=True)
     status = Column(Integer)
-    id_document = Column(Integer, ForeignKey("documents.id_document"))
+    id_document = Column(Integer, ForeignKey("documents.id_document"), index=True)
     document = relationship("Document", overlaps="study_selection")
+
+
+class HarvestCheckpoint(Base):
+    __tablename__ = "harvest_checkpoint"
+    search_query = Column(String, primary_key=True)
+    date_range = Column(String, primary_key=True)
+    next_link = Column(String)
+    pages = Column(Integer, nullable=False, default=0)
+    complete = Column(Boolean, nullable=False, default=False)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class QueryCount(Base):
+    __tablename__ = "query_count"
+    search_query = Column(String, primary_key=True)
+    date_range = Column(String, primary_key=True)
+    total = Column(Integer, nullable=False)
+    counted_at = Column(DateTime, nullable=False)
+
+
+class DocumentQuery(Base):
+    __tablename__ = "document_query"
+    eid = Column(String, primary_key=True)
+    search_query = Column(String, primary_key=True)
+    # The primary key serves the lookups by document, this index the ones by search query
+    __table_args__ = (Index("ix_document_query_search_query", "search_query", "eid"),)
+
+
+class PublisherEnrichment(Base):
+    # Documents whose authors have been fetched, so the ones without any author to insert are not fetched again
+    __tablename__ = "publisher_enrichment"
+    eid = Column(String, primary_key=True)
+    authors = Column(Integer, nullable=False)
+    enriched_at = Column(DateTime, nullable=False)
+
+
+class FetchedEid(Base):
+    # EIDs requested by the second phase of a two-phase harvest, whether a document was stored for them
+    # or not, e.g. when Scopus does not return them or their DOI is already stored under another EID
+    __tablename__ = "fetched_eid"
+    eid = Column(String, primary_key=True)
+    fetched_at = Column(DateTime, nullable=False)
@@ -0,0 +1,168 @@
+import io
+import json
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LOGGER = logging.getLogger("systematic")
+
+# Bytes read from the response at a time by the stream parser
+CHUNK_SIZE = 64 * 1024
+
+
+def loads(content):
+    # Decode a whole JSON document, with orjson when it is installed
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def available_parsers():
+    # Parsers of search pages that can be used with the installed packages
+    return ["stream", "loads"] if ijson is not None else ["loads"]
+
+
+class SearchPage:
+    """
+    Entries and next link of a search results page.
+
+    With the stream parser the page is decoded incrementally with ijson, from
+    bytes or from a file-like object such as the raw socket of a response,
+    and only one entry is held in memory at a time. The next link is known
+    once the entries have been consumed. The loads parser decodes the whole
+    page at once, with orjson when it is installed.
+    """
+
+    def __init__(self, source, parser: str = "stream"):
+        """
+        Constructor for the SearchPage class.
+
+        Parameters:
+        - source: Body of the page, in bytes or as a file-like object.
+        - parser: (str) stream, which needs ijson, or loads.
+        """
+        if parser not in ("stream", "loads"):
+            raise ValueError(f"Unknown parser {parser}, expected stream or loads")
+        if parser == "stream" and ijson is None:
+            LOGGER.warning("ijson is not installed, search pages are decoded at once.")
+            parser = "loads"
+        self._source = source
+        self._parser = parser
+        self.next_link = None
+
+    def entries(self):
+        """
+        Iterate over the entries of the page, as dicts.
+
+        The entry Scopus sends in place of the documents of an empty result
+        set, {"error": "Result set was empty"}, and any other entry without
+        an EID are skipped.
+        """
+        yield from filter(_is_document, self._entries())
+
+    def _entries(self):
+        if self._parser == "loads":
+            content = self._source if isinstance(self._source, bytes | str) else self._source.read()
+            results = loads(content).get("search-results", {})
+            self.next_link = next(
+                (link.get("@href") for link in results.get("link") or [] if link.get("@ref") == "next"), None
+            )
+            yield from results.get("entry") or []
+            return
+
+        # The entries are pulled from the source by ijson, and the chunks it reads are also pushed into a
+        # second parser for the link list, until it has the links since Scopus sends them before the entries
+        source = io.BytesIO(self._source) if isinstance(self._source, bytes) else self._source
+        links = ijson.sendable_list()
+        links_parser = ijson.items_coro(links, "search-results.link")
+
+        def read(size):
+            chunk = source.read(size)
+            if chunk and not links:
+                links_parser.send(chunk)
+            return chunk
+
+        yield from ijson.items(_Reader(read), "search-results.entry.item", buf_size=CHUNK_SIZE)
+        if links:
+            self.next_link = next((link.get("@href") for link in links[0] if link.get("@ref") == "next"), None)
+
+
+def _is_document(entry: dict):
+    return "error" not in entry and bool(entry.get("eid"))
+
+
+class _Reader:
+    # File-like object reading through a function
+    def __init__(self, read):
+        self.read = read
+
+
+# Compact record of a document on the ingest path, with the columns of the documents table but its primary key
+DocumentRow = namedtuple(
+    "DocumentRow",
+    [
+        "title",
+        "abstract",
+        "keywords",
+        "author",
+        "published_date",
+        "doi",
+        "eid",
+        "publication_name",
+        "issn",
+        "eissn",
+        "type",
+        "sub_type",
+        "search_query",
+        "source",
+        "affiliation_country",
+        "citedby_count",
+        "openaccess",
+    ],
+)
+
+
+def _affiliation_country(entry: dict):
+    affiliation = entry.get("affiliation")
+    if affiliation:
+        return affiliation[0].get("affiliation-country")
+    return None
+
+
+def document_row(entry: dict, search_query: str, source: str):
+    """
+    Columns of the document of a search entry, read directly from the entry.
+
+    Returns:
+    - DocumentRow of the entry.
+    """
+    published_date = entry.get("prism:coverDate")
+    return DocumentRow(
+        entry.get("dc:title"),
+        entry.get("dc:description"),
+        entry.get("authkeywords"),
+        entry.get("dc:creator"),
+        datetime.strptime(published_date, "%Y-%m-%d").date() if published_date else None,
+        entry.get("prism:doi"),
+        entry.get("eid"),
+        entry.get("prism:publicationName"),
+        entry.get("prism:issn"),
+        entry.get("prism:eIssn"),
+        entry.get("prism:aggregationType"),
+        entry.get("subtypeDescription"),
+        search_query,
+        source,
+        _affiliation_country(entry),
+        entry.get("citedby-count"),
+        None,
+    )
@@ -0,0 +1,162 @@
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from core.ratelimit import AdaptiveRateLimiter
+from core.scopus import Scopus
+
+LOGGER = logging.getLogger("systematic")
+
+# Results a search query can page through before Scopus stops returning them
+MAX_RESULTS = 5000
+
+# Search query and date range harvested as one cursor, with its number of results
+Shard = namedtuple("Shard", ["search_query", "date_range", "total"])
+
+
+def split_years(date_range: str):
+    """
+    Years of a date range, e.g. "2018-2020" gives ["2018", "2019", "2020"].
+
+    A date range that is not a range of years is returned as it is.
+    """
+    first, _, last = str(date_range).partition("-")
+    if not first.isdigit() or not (last or first).isdigit() or int(last or first) < int(first):
+        return [str(date_range)]
+    return [str(year) for year in range(int(first), int(last or first) + 1)]
+
+
+class QueryPlan:
+    """
+    Shards of a harvest, largest first, and the number of results of every
+    search query over the whole date range.
+    """
+
+    def __init__(self, shards: list, totals: dict):
+        self.shards = shards
+        self.totals = totals
+
+    def __iter__(self):
+        return iter(self.shards)
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __str__(self):
+        width = max((len(s.search_query) for s in self.shards), default=12)
+        lines = [f"{'search query':<{width}}  {'date range':<10}  {'results':>8}"]
+        lines += [f"{s.search_query:<{width}}  {s.date_range:<10}  {s.total:>8}" for s in self.shards]
+        empty = sum(1 for total in self.totals.values() if not total)
+        lines.append(
+            f"{len(self.shards)} shards of {len(self.totals) - empty} search queries, "
+            f"{sum(s.total for s in self.shards)} results, {empty} search queries without results"
+        )
+        return "\n".join(lines)
+
+
+class QueryPlanner:
+    """
+    Plan the harvest of several search queries from their number of results.
+
+    The counts are requested concurrently under the shared rate limiter and
+    stored per search query and date range, so they are only requested again
+    once they are older than max_age_days. Search queries with more than
+    max_results results are split into one shard per year of the date range,
+    which are harvested in parallel and stay under the deep paging limit.
+    Queries without results are left out, and the shards are ordered largest
+    first so the longest cursors start first.
+    """
+
+    def __init__(
+        self,
+        store,
+        search_queries: list,
+        date_range: str,
+        workers: int = 4,
+        rate_limiter: AdaptiveRateLimiter = None,
+        max_results: int = MAX_RESULTS,
+        max_age_days: int = 7,
+        api_url: str = "https://api.elsevier.com",
+    ):
+        """
+        Constructor for the QueryPlanner class.
+
+        Parameters:
+        - store: (SqlAlchemyORM) Store of the counts.
+        - search_queries: (list) Search queries to harvest.
+        - date_range: (str) Year range of the search, e.g. "2018-2022".
+        - workers: (int) Counts requested at the same time.
+        - rate_limiter: (AdaptiveRateLimiter) Shared limiter, defaults to Scopus.rate_limiter.
+        - max_results: (int) Results above which a search query is split by year.
+        - max_age_days: (int) Days after which a stored count is requested again.
+        - api_url: (str) Base url of the Elsevier API.
+        """
+        self._store = store
+        self._search_queries = list(dict.fromkeys(search_queries))
+        self._date_range = str(date_range)
+        self._workers = max(1, workers)
+        self._rate_limiter = rate_limiter or Scopus.rate_limiter
+        self._max_results = max_results
+        self._max_age_days = max_age_days
+        self._api_url = api_url
+        self.requested = 0
+
+    def _count(self, key: tuple):
+        search_query, date_range = key
+        q = Scopus(
+            persistence=lambda: self._store,
+            search_query=search_query,
+            date_range=date_range,
+            rate_limiter=self._rate_limiter,
+            api_url=self._api_url,
+        )
+        return int(q.get_count() or 0)
+
+    def count(self, keys: list):
+        """
+        Number of results of every (search query, date range) pair, from the
+        store when it is fresh and from Scopus otherwise.
+
+        Returns:
+        - Dict of counts keyed by (search query, date range).
+        """
+        counts = self._store.get_query_counts(keys, max_age_days=self._max_age_days)
+        missing = [key for key in keys if key not in counts]
+        if missing:
+            LOGGER.info(f"Counting {len(missing)} search queries, {len(counts)} counts are stored.")
+            with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="planner-count") as pool:
+                fetched = dict(zip(missing, pool.map(self._count, missing), strict=True))
+            self._store.set_query_counts(fetched)
+            self.requested += len(fetched)
+            counts.update(fetched)
+        return counts
+
+    def plan(self):
+        """
+        Count the search queries and split the large ones by year.
+
+        Returns:
+        - QueryPlan with the shards to harvest.
+        """
+        totals = self.count([(s, self._date_range) for s in self._search_queries])
+
+        years = split_years(self._date_range)
+        large = [s for s in self._search_queries if totals[(s, self._date_range)] > self._max_results]
+        by_year = self.count([(s, year) for s in large for year in years]) if len(years) > 1 else {}
+
+        shards = []
+        for s in self._search_queries:
+            total = totals[(s, self._date_range)]
+            if s in large and by_year:
+                shards.extend(Shard(s, year, by_year[(s, year)]) for year in years if by_year[(s, year)])
+            elif total:
+                shards.append(Shard(s, self._date_range, total))
+
+        for shard in shards:
+            if shard.total > self._max_results:
+                LOGGER.warning(
+                    f"{shard.search_query} has {shard.total} results in {shard.date_range}, "
+                    f"more than the {self._max_results} that can be paged through."
+                )
+        shards.sort(key=lambda shard: shard.total, reverse=True)
+        return QueryPlan(shards, {s: totals[(s, self._date_range)] for s in self._search_queries})
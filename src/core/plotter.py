@@ -9,11 +9,13 @@ import matplotlib.pyplot as plt
 import networkx as nx
 import numpy as np
 import pandas as pd
-import pycountry_convert as pc
 from matplotlib.colors import LinearSegmentedColormap
 from matplotlib.patches import Circle
 from shapely.geometry import Point
 
+from core.crud import get_store
+from core.utils import Location, country_to_continent
+
 LOGGER = logging.getLogger("systematic")
 
 
@@ -21,6 +23,16 @@ class Plotter:
     # chose a colormap
     # https://matplotlib.org/2.0.2/users/colormaps.html
 
+    def __init__(self, store=None):
+        """
+        Constructor for the Plotter class.
+
+        Parameters:
+        - store: (SqlAlchemyORM) Store the plotted data is read from when it is not given,
+          the process-wide store by default.
+        """
+        self._store = store or get_store()
+
     def defining_spacing(self, param_list: list):
         if len(param_list) < 6:
             spacing_set = 18
@@ -31,15 +43,9 @@ class Plotter:
 
         return spacing_set
 
-    def count_clean_countries(self, country_list: list):
-        # Clean the list and count the ocurrencies of every country and ignore the empty ones
-        new_list = []
-
-        for i in range(len(country_list)):
-            if country_list[i] is not None:
-                new_list.append(country_list[i])
-
-        country_count = Counter(new_list)
+    def count_clean_countries(self, country_list):
+        # Count the ocurrencies of every country and ignore the empty ones, consuming the countries one by one
+        country_count = Counter(country for country in country_list if country is not None)
 
         # Order contries using frequency
         sorted_countries = sorted(country_count.items(), key=lambda x: x[1], reverse=True)
@@ -48,7 +54,16 @@ class Plotter:
 
         return countries, counts, sorted_countries
 
-    def plot_type(self, document_types: list):
+    def _country_counts(self, country_list):
+        # Countries ordered by number of documents, counted by the store unless the countries are given
+        if country_list is not None:
+            return self.count_clean_countries(country_list)
+        sorted_countries = self._store.count_by_country()
+        return [country for country, _ in sorted_countries], [count for _, count in sorted_countries], sorted_countries
+
+    def plot_type(self, document_types: list = None):
+        if document_types is None:
+            document_types = self._store.count_by_sub_type()
         labels, sizes = zip(*document_types, strict=True)
 
         fig, ax = plt.subplots()
@@ -71,8 +86,8 @@ class Plotter:
         plt.tight_layout()
         plt.show()
 
-    def show_country_bar_diagram(self, country_list: list):
-        countries, counts, _ = self.count_clean_countries(country_list)
+    def show_country_bar_diagram(self, country_list: list = None):
+        countries, counts, _ = self._country_counts(country_list)
 
         # Create the graph
         plt.figure(figsize=(14, 8))
@@ -94,7 +109,9 @@ class Plotter:
         plt.tight_layout()
         plt.show()
 
-    def plot_bar_type(self, document_years: list):
+    def plot_bar_type(self, document_years: list = None):
+        if document_years is None:
+            document_years = self._store.count_by_year()
         df = pd.DataFrame(document_years, columns=["year", "number_of_articles"])
 
         fig, ax = plt.subplots()
@@ -113,8 +130,8 @@ class Plotter:
 
         plt.show()
 
-    def show_country_map(self, country_list: list):
-        countries, counts, sorted_countries = self.count_clean_countries(country_list)
+    def show_country_map(self, country_list: list = None):
+        countries, counts, sorted_countries = self._country_counts(country_list)
 
         # Load the world shapefile
         shapefile_path = "src/files/ne_110m_admin_0_countries.shp"
@@ -231,22 +248,51 @@ class Plotter:
         plt.savefig(f"{tempfile.gettempdir()}/fig_continent.pdf")
 
     def get_continent(self, country_name):
-        country_alpha2 = pc.country_name_to_country_alpha2(country_name)
-        country_continent_code = pc.country_alpha2_to_continent_code(country_alpha2)
-        country_continent_name = pc.convert_continent_code_to_continent_name(country_continent_code)
-
-        return country_continent_name
-
-    def plot_geo_continent(self, documents_per_country: list):
-        # Count occurrences of each continent
-        continent_counts = {}
-        for country_name in documents_per_country:
-            if country_name:
-                continent = self.get_continent(country_name)
-                if continent:
-                    continent_counts[continent] = continent_counts.get(continent, 0) + 1
-
-        documents_per_continent = continent_counts
+        return country_to_continent(country_name)
+
+    def documents_per_continent(self, documents_per_country: list = None):
+        """
+        Number of documents of every continent.
+
+        Without the countries of the documents, the store counts them with
+        the continents table, and the countries missing from it are mapped
+        in memory for the plot alone, the table is only filled by
+        --fill-continent.
+
+        Parameters:
+        - documents_per_country: (list) Affiliation country of every document.
+
+        Returns:
+        - Counter of documents keyed by continent.
+        """
+        if documents_per_country is None:
+            documents_per_continent = Counter(dict(self._store.count_by_continent()))
+            continents, unresolved = Location().continent_map(self._store.get_empty_continents())
+            if unresolved:
+                LOGGER.warning(
+                    f"Cannot get continent for {len(unresolved)} countries, their documents are excluded: "
+                    f"{', '.join(unresolved)}"
+                )
+            if continents:
+                for country_name, count in self._store.count_by_country():
+                    if country_name in continents:
+                        documents_per_continent[continents[country_name]] += count
+            return documents_per_continent
+
+        # Count the documents of each country first, so every distinct country is looked up once
+        country_counts = Counter(country for country in documents_per_country if country)
+        continents, unresolved = Location().continent_map(country_counts)
+        if unresolved:
+            LOGGER.warning(f"Cannot get continent for {len(unresolved)} countries: {', '.join(unresolved)}")
+
+        documents_per_continent = Counter()
+        for country_name, count in country_counts.items():
+            if country_name in continents:
+                documents_per_continent[continents[country_name]] += count
+        return documents_per_continent
+
+    def plot_geo_continent(self, documents_per_country: list = None):
+        documents_per_continent = self.documents_per_continent(documents_per_country)
 
         world = gpd.read_file("src/files/ne_110m_admin_0_countries.shp")
 
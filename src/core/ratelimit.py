@@ -0,0 +1,147 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+LOGGER = logging.getLogger("systematic")
+
+
+def backoff(attempt: int, base: float = 1.0, cap: float = 60.0):
+    """
+    Seconds to wait before retrying, exponential with full jitter.
+
+    Parameters:
+    - attempt: (int) Number of the failed attempt, starting at 0.
+    - base: (float) Upper bound of the first wait.
+    - cap: (float) Upper bound of any wait.
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def retry_after(headers):
+    """
+    Seconds requested by a Retry-After header, either in seconds or as an
+    HTTP date, or None when the header is missing or malformed.
+    """
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Thread-safe token bucket shared by every endpoint of an API.
+
+    The bucket refills at up to max_rate tokens per second. Its rate adapts
+    to the responses: it is halved on every 429 response and grows back
+    additively on every successful one, and when X-RateLimit-Remaining gets
+    below low_watermark the remaining requests are spread until
+    X-RateLimit-Reset. Retry-After, or an exhausted quota, pauses every caller.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 1, min_rate: float = 0.05, low_watermark: int = 100):
+        """
+        Constructor for the AdaptiveRateLimiter class.
+
+        Parameters:
+        - rate: (float) Maximum requests per second.
+        - burst: (int) Requests that can be sent at once after an idle period.
+        - min_rate: (float) Lower bound of the adapted rate.
+        - low_watermark: (int) Remaining quota below which requests are spread until the reset.
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError("Rate limiter needs a positive rate and burst")
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min(min_rate, rate)
+        self.low_watermark = low_watermark
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Block until a token is available and take it.
+
+        The wait is computed under the lock but slept outside of it, so the
+        other callers, update and throttled are not held back meanwhile.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def pause(self, seconds: float):
+        """
+        Hold every caller back for the given number of seconds.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def update(self, headers):
+        """
+        Adapt the rate to the quota headers of a successful response.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            rate = min(self.max_rate, self.rate + self.max_rate / 10)
+            try:
+                remaining = int(headers["X-RateLimit-Remaining"])
+                window = float(headers["X-RateLimit-Reset"]) - time.time()
+            except (KeyError, TypeError, ValueError):
+                remaining, window = None, 0
+
+            if remaining is not None and window > 0:
+                if remaining <= 0:
+                    LOGGER.warning(f"API quota exhausted, pausing for {window:.0f} seconds.")
+                    self._paused_until = max(self._paused_until, time.monotonic() + window)
+                elif remaining < self.low_watermark:
+                    rate = min(rate, remaining / window)
+            self.rate = max(self.min_rate, rate)
+
+    def throttled(self, headers):
+        """
+        Slow down after a 429 response, honouring its Retry-After header.
+
+        Returns:
+        - Seconds requested by Retry-After, or None if the server gave none.
+          A Retry-After of 0 asks for no pause, so the caller should back off
+          as if there was none.
+        """
+        wait = retry_after(headers)
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if wait:
+                self._paused_until = max(self._paused_until, time.monotonic() + wait)
+        LOGGER.warning(f"Too many requests, rate lowered to {self.rate:.2f} requests per second.")
+        return wait
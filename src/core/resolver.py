@@ -0,0 +1,269 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urljoin, urlsplit
+
+from core.ratelimit import AdaptiveRateLimiter
+from core.transport import Transport, get_transport
+
+LOGGER = logging.getLogger("systematic")
+
+REDIRECT_CODES = {301, 302, 303, 307, 308}
+
+
+def doi_prefix(doi: str):
+    # Registrant prefix of a DOI, e.g. 10.1109 for 10.1109/ACCESS.2020.1
+    return doi.split("/", 1)[0].strip().lower()
+
+
+class PrefixHostCache:
+    """
+    Publisher host of every DOI prefix, learned from the resolved DOIs.
+
+    DOIs sharing a registrant prefix nearly always resolve to the same host,
+    so once a prefix has min_samples resolutions and one host holds at least
+    min_share of them, its DOIs are answered without going to the network.
+    A sample_rate fraction of those DOIs is still resolved to confirm the
+    prediction, and a mismatch is learned like any other resolution.
+    """
+
+    def __init__(self, min_samples: int = 5, min_share: float = 0.9, sample_rate: float = 0.05, seed: int = None):
+        """
+        Constructor for the PrefixHostCache class.
+
+        Parameters:
+        - min_samples: (int) Resolutions of a prefix needed to trust it.
+        - min_share: (float) Share of the resolutions of a prefix its host must hold.
+        - sample_rate: (float) Fraction of the predicted DOIs resolved anyway.
+        - seed: (int) Seed of the sampling, for reproducible runs.
+        """
+        self._min_samples = min_samples
+        self._min_share = min_share
+        self._sample_rate = sample_rate
+        self._random = random.Random(seed)
+        self._hosts = {}
+        self.hits = 0
+        self.misses = 0
+        self.sampled = 0
+        self.mismatches = 0
+
+    def learn(self, prefix_hosts):
+        """
+        Add resolutions in bulk.
+
+        Parameters:
+        - prefix_hosts: Tuples of prefix, host and number of DOIs.
+        """
+        for prefix, host, count in prefix_hosts:
+            self._hosts.setdefault(prefix.lower(), Counter())[host] += count
+
+    def add(self, doi: str, host: str, predicted: str = None):
+        # Learn a resolution, checking it against the host that was predicted for it
+        if predicted is not None and host != predicted:
+            self.mismatches += 1
+            LOGGER.warning(f"Prefix of {doi} predicted {predicted} but it resolves to {host}.")
+        self._hosts.setdefault(doi_prefix(doi), Counter())[host] += 1
+
+    def lookup(self, doi: str):
+        """
+        Predict the publisher host of a DOI.
+
+        Returns:
+        - Tuple with the predicted host, or None when the prefix is not
+          trusted, and whether the DOI must be resolved anyway.
+        """
+        hosts = self._hosts.get(doi_prefix(doi))
+        if hosts:
+            host, count = hosts.most_common(1)[0]
+            total = hosts.total()
+            if total >= self._min_samples and count >= self._min_share * total:
+                if self._random.random() < self._sample_rate:
+                    self.sampled += 1
+                    return host, True
+                self.hits += 1
+                return host, False
+        self.misses += 1
+        return None, True
+
+    def report(self):
+        lookups = self.hits + self.sampled + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return (
+            f"Prefix cache hit rate {rate:.1%}: {self.hits} DOIs predicted, {self.misses} unknown prefixes, "
+            f"{self.sampled} sampled with {self.mismatches} mismatches, {len(self._hosts)} prefixes learned."
+        )
+
+
+class DoiResolver:
+    """
+    Resolve DOIs to the host of their publisher, many of them at a time.
+
+    Every DOI is resolved with HEAD requests that follow the redirects by
+    hand up to the final response, whose host is the one stored, as the
+    effective url of a GET used to be. Requests go
+    through the pooled transport, so the connections to the resolver are
+    reused, and at most per_host requests are sent to the same host at once.
+    """
+
+    def __init__(
+        self,
+        transport: Transport = None,
+        resolver_url: str = "https://doi.org/",
+        workers: int = 8,
+        per_host: int = 8,
+        rate_limiter: AdaptiveRateLimiter = None,
+        max_redirects: int = 10,
+        timeout: float = 30,
+        prefix_cache: PrefixHostCache = None,
+    ):
+        """
+        Constructor for the DoiResolver class.
+
+        Parameters:
+        - transport: (Transport) Pooled transport, defaults to the process-wide one.
+        - resolver_url: (str) Url of the DOI resolver, the DOI is appended to it.
+        - workers: (int) DOIs resolved at the same time.
+        - per_host: (int) Maximum requests in flight to the same host.
+        - rate_limiter: (AdaptiveRateLimiter) Limiter of the requests, if any.
+        - max_redirects: (int) Redirects followed before giving up on a DOI.
+        - timeout: (float) Timeout of every request, in seconds.
+        - prefix_cache: (PrefixHostCache) Hosts learned by DOI prefix, consulted before the network.
+        """
+        self._transport = transport or get_transport()
+        self._resolver_url = resolver_url
+        self._workers = max(1, workers)
+        self._per_host = per_host
+        self._rate_limiter = rate_limiter
+        self._max_redirects = max_redirects
+        self._timeout = timeout
+        self._prefix_cache = prefix_cache
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+        self.requests = 0
+        self.resolved = 0
+        self.failed = 0
+
+    def _host_slot(self, host: str):
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self._per_host)
+            return self._hosts[host]
+
+    def _request(self, url: str):
+        # HEAD is enough to read the redirect, servers that refuse it are asked with GET
+        with self._host_slot(urlsplit(url).netloc):
+            kwargs = {"allow_redirects": False, "timeout": self._timeout, "rate_limiter": self._rate_limiter}
+            response = self._transport.head(url, **kwargs)
+            sent = 1
+            if response.status_code in (403, 405, 501):
+                response = self._transport.get(url, **kwargs)
+                sent += 1
+        with self._hosts_lock:
+            self.requests += sent
+        return response
+
+    def resolve(self, doi: str):
+        """
+        Resolve a DOI.
+
+        Returns:
+        - Host of the final url of the DOI, once no more redirects are left.
+          The host is known whatever the status of its page, publishers often
+          refuse robots with a 403, so only an error of the resolver itself
+          (an unknown DOI) fails.
+        """
+        url = self._resolver_url + doi
+        for hop in range(self._max_redirects + 1):
+            response = self._request(url)
+            location = response.headers.get("Location")
+            if response.status_code not in REDIRECT_CODES or not location:
+                if hop == 0:
+                    response.raise_for_status()
+                return urlsplit(response.url or url).netloc
+            url = urljoin(url, location)
+        raise RuntimeError(f"Too many redirects resolving {doi}")
+
+    def resolve_all(self, dois, store, batch_size: int = 200, window: int = None):
+        """
+        Resolve every DOI and store the publisher hosts in doi_eurl.
+
+        The hosts are committed every batch_size DOIs, so an interrupted run
+        only loses the last batch. DOIs that fail are logged and left for the
+        next run. The DOIs are consumed as they are submitted, with at most
+        window of them in flight. With a prefix cache, it first learns the
+        hosts already in doi_eurl, and every DOI is looked up right before it
+        is submitted, so the hosts resolved earlier in the run answer the
+        DOIs of trusted prefixes without going to the network.
+
+        Parameters:
+        - dois: DOIs to resolve, an iterable consumed incrementally.
+        - store: (SqlAlchemyORM) Store where the hosts are saved.
+        - batch_size: (int) DOIs committed per transaction.
+        - window: (int) DOIs in flight at once, defaults to 4 per worker.
+
+        Returns:
+        - Number of resolved DOIs.
+        """
+        cache = self._prefix_cache
+        if cache is not None:
+            cache.learn(store.get_prefix_hosts())
+
+        window = max(1, window or self._workers * 4)
+        LOGGER.info(f"Resolving DOIs with {self._workers} workers, {window} in flight.")
+        start = time.perf_counter()
+        batch = []
+        pending = iter(dois)
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="resolve-doi") as pool:
+            futures = {}
+            try:
+                while True:
+                    for doi in pending:
+                        predicted, resolve = cache.lookup(doi) if cache is not None else (None, True)
+                        if resolve:
+                            futures[pool.submit(self.resolve, doi)] = (doi, predicted)
+                        else:
+                            batch.append((doi, predicted))
+                        if len(batch) >= batch_size:
+                            self._commit(store, batch, start)
+                            batch = []
+                        if len(futures) >= window:
+                            break
+                    if not futures:
+                        break
+
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        doi, predicted = futures.pop(future)
+                        try:
+                            host = future.result()
+                            batch.append((doi, host))
+                            if cache is not None:
+                                cache.add(doi, host, predicted)
+                        except Exception as error:
+                            self.failed += 1
+                            LOGGER.warning(f"Error={error} resolving {doi}")
+                        if len(batch) >= batch_size:
+                            self._commit(store, batch, start)
+                            batch = []
+                self._commit(store, batch, start)
+            except BaseException:
+                pool.shutdown(wait=True, cancel_futures=True)
+                raise
+
+        if cache is not None:
+            LOGGER.info(cache.report())
+        return self.resolved
+
+    def _commit(self, store, batch: list, start: float):
+        if not batch:
+            return
+        store.set_doi_eurls(batch)
+        self.resolved += len(batch)
+        elapsed = time.perf_counter() - start
+        LOGGER.info(
+            f"{self.resolved} DOIs resolved, {self.failed} failed, {self.requests} requests, "
+            f"{self.resolved / elapsed:.1f} DOIs/s"
+        )
@@ -2,17 +2,18 @@ import json
 import logging
 import os
 import time
-import urllib
-import urllib.request
-from datetime import datetime
+import urllib.parse
 from http import HTTPStatus
 
 import requests
-from ratelimiter import RateLimiter
 
-from core.models import Document, Journal, Manuscript
+from core.cache import strip_api_key
+from core.models import Journal
+from core.parsing import SearchPage, available_parsers, document_row
 from core.query import Query
-from core.utils import Persistence, Sqlite
+from core.ratelimit import AdaptiveRateLimiter, backoff
+from core.transport import Transport, get_transport
+from core.utils import Persistence
 
 LOGGER = logging.getLogger("systematic")
 
@@ -22,52 +23,138 @@ https://dev.elsevier.com/documentation/ScopusSearchAPI.wadl
 https://dev.elsevier.com/documentation/SerialTitleAPI.wadl
 """
 
+# Fields of a search entry read by document_row, the rest of the entry is discarded
+ENTRY_FIELDS = (
+    "dc:title",
+    "dc:description",
+    "authkeywords",
+    "dc:creator",
+    "prism:coverDate",
+    "eid",
+    "prism:doi",
+    "prism:publicationName",
+    "prism:issn",
+    "prism:eIssn",
+    "prism:aggregationType",
+    "subtypeDescription",
+    "affiliation-country",
+    "citedby-count",
+)
+
+# Fields only returned by the COMPLETE view
+COMPLETE_FIELDS = ("dc:description", "authkeywords")
+
+# View, entries per page and field restriction of every projection of the search results:
+# - complete: the whole COMPLETE view.
+# - fields: the COMPLETE view restricted to ENTRY_FIELDS, the same documents in lighter pages.
+# - standard: the STANDARD view, which allows larger pages but has no abstract nor keywords.
+PROJECTIONS = {
+    "complete": ("COMPLETE", 25, None),
+    "fields": ("COMPLETE", 25, ENTRY_FIELDS),
+    "standard": ("STANDARD", 200, tuple(f for f in ENTRY_FIELDS if f not in COMPLETE_FIELDS)),
+}
+
+# View, entries per page and fields of the first phase of a two-phase harvest, which only collects the EIDs
+EID_PROJECTION = ("STANDARD", 200, ("eid",))
+
 
 class Scopus(Query):
-    def __init__(self, persistence: Persistence, search_query: str, date_range: str):
+    # Rate limiter shared by every instance and endpoint, so concurrent requests draw from the same quota
+    rate_limiter = AdaptiveRateLimiter(rate=1, burst=1)
+
+    def __init__(
+        self,
+        persistence: Persistence,
+        search_query: str,
+        date_range: str,
+        rate_limiter: AdaptiveRateLimiter = None,
+        transport: Transport = None,
+        author_store=None,
+        author_max_age: int = 180,
+        author_batch_size: int = 25,
+        api_url: str = "https://api.elsevier.com",
+        projection: str = "complete",
+        parser: str = None,
+    ):
         super().__init__(persistence)
 
+        # Parser of the search pages, the fastest one installed by default
+        self._parser = parser or available_parsers()[0]
+
+        # View, page size and fields requested to the search endpoint
+        if projection not in PROJECTIONS:
+            raise ValueError(f"Unknown projection {projection}, expected one of {', '.join(PROJECTIONS)}")
+        self._view, self._page_size, self._fields = PROJECTIONS[projection]
+
+        # Store of the author profiles already fetched, and days after which they are fetched again.
+        # Author lookups answered by the store count as hits, and profiles fetched as misses
+        self._author_store = author_store
+        self._author_max_age = author_max_age
+        self._author_batch_size = author_batch_size
+        self.author_hits = 0
+        self.author_misses = 0
+
+        if rate_limiter is not None:
+            self.rate_limiter = rate_limiter
+        self._transport = transport or get_transport()
+
         self._name = "Scopus"
 
         self._raw_search_query = search_query
-        self._search_query = urllib.request.quote(search_query)
+        self._search_query = urllib.parse.quote(search_query)
         self._date_range = date_range
 
         # Check API key
         self._api_key = os.environ["ELSEVIER_API_KEY"]
 
         # Base api query url
-        self._base_url = "https://api.elsevier.com/content/search/scopus?"
-
-    def stubborn_url_open(self, url):
-        request = urllib.request.Request(url)
-        request.add_header("User-Agent", "SurveyRuntime/1.0.0")
-        request.add_header("Connection", "keep-alive")
-        request.add_header("Accept", "application/json")
-        for _ in range(10):
-            try:
-                response = urllib.request.urlopen(request, timeout=300)
-                LOGGER.info(f"{response.getheader('X-RateLimit-Remaining')} " f"requests left.")
+        self._api_url = api_url
+        self._base_url = f"{api_url}/content/search/scopus?"
 
-                return response
-            except TimeoutError as e:
-                LOGGER.error(f"Error while opening url, error = {e}")
-                time.sleep(60)
-            except urllib.error.HTTPError as e:
+    def stubborn_url_open(self, url, attempts: int = 10, stream: bool = False):
+        error = None
+        for attempt in range(attempts):
+            try:
+                response = self._transport.get(url, timeout=300, rate_limiter=self.rate_limiter, stream=stream)
+            except (requests.Timeout, requests.ConnectionError) as e:
                 LOGGER.error(f"Error while opening url, error = {e}")
-                if e.code == HTTPStatus.TOO_MANY_REQUESTS:
-                    raise (e)
+                error = e
+                time.sleep(backoff(attempt))
+                continue
+
+            if response.status_code >= HTTPStatus.BAD_REQUEST:
+                # Responses that are not returned give their pooled connection back, even when streamed
+                response.close()
+
+            if response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+                error = requests.HTTPError(f"{response.status_code} Too Many Requests", response=response)
+                # A missing or zero Retry-After pauses nobody, so back off instead of retrying at once
+                if not self.rate_limiter.throttled(response.headers):
+                    time.sleep(backoff(attempt))
+                continue
+            if response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+                LOGGER.error(f"Error while opening url, status = {response.status_code}")
+                error = requests.HTTPError(f"{response.status_code} Server Error", response=response)
+                time.sleep(backoff(attempt))
+                continue
+
+            response.raise_for_status()
+            if getattr(response, "from_cache", False):
+                return response
+            self.rate_limiter.update(response.headers)
+            LOGGER.info(f"{response.headers.get('X-RateLimit-Remaining')} requests left.")
 
-                time.sleep(60)
+            return response
 
-    @RateLimiter(max_calls=2, period=3)
-    def get_publishers_by_eid(self, eid: str):
-        url = f"https://api.elsevier.com/content/abstract/eid/{eid}" f"?apiKey={self._api_key}"
+        raise error
+
+    def get_authors_by_eid(self, eid: str):
+        url = f"{self._api_url}/content/abstract/eid/{eid}?apiKey={self._api_key}"
 
         # Get document information using the eid
         response = self.stubborn_url_open(url=url)
 
-        json_respon = json.loads(response.read())
+        json_respon = json.loads(response.content)
 
         authors_list = []
 
@@ -75,61 +162,57 @@ class Scopus(Query):
         try:
             # First type of json response for authors
             for auth in json_respon["abstracts-retrieval-response"]["item"]["bibrecord"]["head"]["author-group"]:
-                author_info = {}
-                affiliation = auth.get("affiliation")
-                if affiliation:
-                    country = affiliation.get("country")
-                    city = affiliation.get("city")
-                    author_info["country"] = country
-                    author_info["city"] = city
-                else:
-                    author_info["country"] = None
-                    author_info["city"] = None
-
-                for author in auth.get("author", []):
-                    author_info["given_name"] = author.get("ce:given-name")
-                    author_info["surname"] = author.get("ce:surname")
-                    author_info["auid"] = author.get("@auid")
-
-                    authors_list.append(author_info)
+                authors_list.extend(self._parse_author_group(auth))
 
         except Exception:
             try:
                 # Second type of json response for authors
                 author_group = json_respon["abstracts-retrieval-response"]["item"]["bibrecord"]["head"]["author-group"]
-                affiliation = author_group.get("affiliation")
-                if affiliation:
-                    country = affiliation.get("country")
-                    city = affiliation.get("city")
-                    author_info["country"] = country
-                    author_info["city"] = city
-                else:
-                    author_info["country"] = None
-                    author_info["city"] = None
-
-                for author in author_group.get("author", []):
-                    author_info["given_name"] = author.get("ce:given-name")
-                    author_info["surname"] = author.get("ce:surname")
-                    author_info["auid"] = author.get("@auid")
-
-                    authors_list.append(author_info)
+                authors_list.extend(self._parse_author_group(author_group))
 
             except Exception as e:
                 LOGGER.info(f"There is an error, the error is {e} and json response is {json_respon}")
                 authors_list = None
 
+        return authors_list
+
+    @staticmethod
+    def _parse_author_group(auth: dict):
+        affiliation = auth.get("affiliation")
+        if affiliation:
+            country = affiliation.get("country")
+            city = affiliation.get("city")
+        else:
+            country = None
+            city = None
+
+        return [
+            {
+                "country": country,
+                "city": city,
+                "given_name": author.get("ce:given-name"),
+                "surname": author.get("ce:surname"),
+                "auid": author.get("@auid"),
+            }
+            for author in auth.get("author", [])
+        ]
+
+    def get_publishers_by_eid(self, eid: str):
+        authors_list = self.get_authors_by_eid(eid)
+
         if authors_list:
             authors_list = self.extend_authors_info(auth_list=authors_list)
 
         return authors_list
 
     def get_publisher(self, issn: str, eissn: str, eid: str):
-        cache = Sqlite()
+        # The publishers are cached by ISSN and EISSN in the store of the documents
+        cache = self._persistence()
         publisher = None
         if issn:
-            publisher = cache.get_publisher_by_issn(issn=issn)
+            publisher = (cache.get_publisher_by_issn(issn=issn) or {}).get("publisher")
         if not publisher and eissn:
-            publisher = cache.get_publisher_by_eissn(eissn=eissn)
+            publisher = (cache.get_publisher_by_eissn(eissn=eissn) or {}).get("publisher")
         if not publisher and eid:
             LOGGER.info(f"Not issn = {issn} nor eissn = {eissn} are yet cached, " f"eid = {eid}")
             publisher = self.get_publisher_by_eid(eid=eid)
@@ -141,12 +224,11 @@ class Scopus(Query):
 
         return publisher
 
-    @RateLimiter(max_calls=2, period=1)
     def get_impact_by_issn(self, issn: str):
-        url = f"https://api.elsevier.com/content/serial/title/issn/{issn}" f"?apiKey={self._api_key}"
+        url = f"{self._api_url}/content/serial/title/issn/{issn}?apiKey={self._api_key}"
 
         response = self.stubborn_url_open(url=url)
-        json_response = json.loads(response.read())
+        json_response = json.loads(response.content)
 
         try:
             entry = json_response.get("serial-metadata-response").get("entry")[0]
@@ -175,47 +257,100 @@ class Scopus(Query):
     def get_impact(self, issn):
         pass
 
-    @RateLimiter(max_calls=1, period=1)
-    def next_page(self, url):
-        response = self.stubborn_url_open(url=url)
-        json_response = json.loads(response.read())
-
-        json_entries = json_response.get("search-results").get("entry")
-
-        entries = []
-        if json_entries:
-            for e in json_entries:
-                m = self.Entry(e, self._raw_search_query, self._name).to_document()
-                entries.append(m)
-
-        json_links = json_response.get("search-results").get("link")
+    def fetch_rows(self, url):
+        # Decode a search page as it comes off the socket, straight into document rows
+        response = self.stubborn_url_open(url=url, stream=True)
+        raw = getattr(response, "raw", None)
+        if raw is not None and not getattr(response, "_content_consumed", True):
+            raw.decode_content = True
+            page = SearchPage(raw, self._parser)
+        else:
+            page = SearchPage(response.content, self._parser)
+        try:
+            rows = [document_row(e, self._raw_search_query, self._name) for e in page.entries()]
+        finally:
+            if hasattr(response, "close"):
+                response.close()
+        return rows, page.next_link
 
-        next_link = None
-        for link in filter(lambda x: x.get("@ref") == "next", json_links):
-            next_link = link.get("@href")
+    def next_page(self, url):
+        return self.fetch_rows(url)
 
-        return entries, next_link
+    def first_link(self):
+        return self._search_link(self._view, self._page_size, self._fields)
 
-    def fetch_all(self):
-        p = self._persistence()
+    def eids_link(self):
+        # First page of the search restricted to the EIDs of the documents
+        return self._search_link(*EID_PROJECTION)
 
+    def _search_link(self, view: str, page_size: int, fields: tuple):
         query = (
             f"query={self._search_query}"
             f"&cursor=*"
             f"&date={self._date_range}"
-            f"&view=COMPLETE"
-            f"&apiKey={self._api_key}"
+            f"&view={view}"
+            f"&count={page_size}"
         )
+        if fields:
+            query += f"&field={','.join(fields)}"
+
+        return self._base_url + query + f"&apiKey={self._api_key}"
+
+    def fetch_eids(self, eids: list):
+        # Document rows of up to a page of EIDs with one search request in the projection of the harvest.
+        # The rows keep the search query of this instance
+        query = urllib.parse.quote(" OR ".join(f"EID({eid})" for eid in eids))
+        url = self._base_url + f"query={query}&view={self._view}&count={min(len(eids), self._page_size)}"
+        if self._fields:
+            url += f"&field={','.join(self._fields)}"
+        next_link = url + f"&apiKey={self._api_key}"
+
+        rows = []
+        while next_link:
+            page, next_link = self.fetch_rows(next_link)
+            if not page:
+                break
+            rows.extend(page)
+        return rows
+
+    @staticmethod
+    def strip_api_key(url: str):
+        return strip_api_key(url)
+
+    def add_api_key(self, url: str):
+        return f"{url}&apiKey={self._api_key}"
+
+    def iter_pages(self, next_link: str = None):
+        next_link = next_link or self.first_link()
+
+        rows = True
+        while rows and next_link:
+            rows, next_link = self.next_page(next_link)
+            if rows:
+                yield rows, next_link
 
-        next_link = self._base_url + query
+    def fetch_all(self):
+        p = self._persistence()
 
-        entries = True
-        while entries and next_link:
-            entries, next_link = self.next_page(next_link)
-            if entries:
-                p.save(entries)
+        # Resume from the cursor of the last committed page, if any
+        checkpoint = p.get_checkpoint(self._raw_search_query, self._date_range)
+        if checkpoint and checkpoint["complete"]:
+            LOGGER.info(f"Query {self._raw_search_query} already harvested, skipping it.")
+            return
+
+        next_link, pages = None, 0
+        if checkpoint and checkpoint["next_link"]:
+            next_link, pages = self.add_api_key(checkpoint["next_link"]), checkpoint["pages"]
+            LOGGER.info(f"Resuming query {self._raw_search_query} after page {pages}.")
+
+        for rows, link in self.iter_pages(next_link):
+            p.save_rows(rows)
+            pages += 1
+            if link:
+                p.set_checkpoint(self._raw_search_query, self._date_range, self.strip_api_key(link), pages)
+
+        p.set_checkpoint(self._raw_search_query, self._date_range, None, pages, complete=True)
 
-    @RateLimiter(max_calls=1, period=1)
     def get_count(self):
         query = (
             f"query={self._search_query}" f"&start=0" f"&count=5" f"&date={self._date_range}" f"&apiKey={self._api_key}"
@@ -223,7 +358,7 @@ class Scopus(Query):
         url = self._base_url + query
 
         response = self.stubborn_url_open(url=url)
-        json_response = json.loads(response.read())
+        json_response = json.loads(response.content)
 
         return json_response.get("search-results").get("opensearch:totalResults")
 
@@ -236,101 +371,117 @@ class Scopus(Query):
             if publisher:
                 p.set_publisher(publishers=[(id_document, publisher)])
 
-    @RateLimiter(max_calls=2, period=3)
-    def extend_authors_info(self, auth_list: list):
-        # Once we obtain an author list of the document, we obtain more detail information about each one
-        for i in range(len(auth_list)):
-            url = f"https://api.elsevier.com/content/author/author_id/{auth_list[i]['auid']}" f"?apiKey={self._api_key}"
+    def get_author_profile(self, auid: str):
+        url = f"{self._api_url}/content/author/author_id/{auid}?apiKey={self._api_key}"
+
+        response = self.stubborn_url_open(url=url)
+
+        data = json.loads(response.content)
+
+        return self._parse_author_profile(data["author-retrieval-response"][0])
+
+    def get_author_profiles(self, auids):
+        # Fetch several author profiles per request, splitting the combined response by author id
+        auids = list(auids)
+        profiles = {}
+        for start in range(0, len(auids), self._author_batch_size):
+            batch = auids[start : start + self._author_batch_size]
+            url = f"{self._api_url}/content/author?author_id={','.join(batch)}&apiKey={self._api_key}"
 
             response = self.stubborn_url_open(url=url)
 
-            data = json.loads(response.read())
+            data = json.loads(response.content)
+
+            authors = data["author-retrieval-response-list"]["author-retrieval-response"]
+            if isinstance(authors, dict):
+                authors = [authors]
+            for author in authors:
+                # Malformed or error entries are left out, so their authors are reported as missing below
+                identifier = (author.get("coredata") or {}).get("dc:identifier")
+                if not identifier:
+                    continue
+                auid = identifier.removeprefix("AUTHOR_ID:")
+                try:
+                    profiles[auid] = self._parse_author_profile(author)
+                except (KeyError, TypeError) as e:
+                    LOGGER.warning(f"Author {auid} has an incomplete profile, error = {e}")
+
+            for auid in set(batch) - profiles.keys():
+                LOGGER.warning(f"Author {auid} is missing from the author retrieval response.")
+
+        return profiles
+
+    @staticmethod
+    def _parse_author_profile(author: dict):
+        date_created = author["author-profile"]["date-created"]
+        publication_range = author["author-profile"]["publication-range"]
+        start_year = publication_range["@start"]
+        end_year = publication_range["@end"]
+
+        return {
+            "document_count": author["coredata"]["document-count"],
+            "cited_by_count": author["coredata"]["cited-by-count"],
+            "citation_count": author["coredata"]["citation-count"],
+            "creation_date": f"{date_created['@day']}-{date_created['@month']}-{date_created['@year']}",
+            "publication_range": f"{start_year}-{end_year}",
+        }
+
+    def _stored_author_profiles(self, auids: set):
+        if not self._author_store:
+            return {}
+        return self._author_store.get_author_profiles(auids, max_age_days=self._author_max_age)
+
+    def prefetch_author_profiles(self, auids):
+        # Fetch the profiles of the distinct authors missing from the author store, or stale in it
+        auids = {auid for auid in auids if auid}
+        stored = self._stored_author_profiles(auids)
+        missing = auids - stored.keys()
+        LOGGER.info(f"Prefetching {len(missing)} author profiles, {len(stored)} already stored.")
+
+        missing = list(missing)
+        chunk = 100 * self._author_batch_size
+        for start in range(0, len(missing), chunk):
+            profiles = self.get_author_profiles(missing[start : start + chunk])
+            self.author_misses += len(profiles)
+            if self._author_store and profiles:
+                self._author_store.set_author_profiles(profiles)
+
+    def extend_authors_info(self, auth_list: list):
+        # Once we obtain an author list of the document, we obtain more detail information about each one.
+        # Profiles are read from the author store first, and only the missing or stale ones are fetched
+        auids = {author["auid"] for author in auth_list if author["auid"]}
+        profiles = self._stored_author_profiles(auids)
+        self.author_hits += len(profiles)
 
-            author = data["author-retrieval-response"][0]
+        fetched = self.get_author_profiles(auids - profiles.keys())
+        self.author_misses += len(fetched)
+        if self._author_store and fetched:
+            self._author_store.set_author_profiles(fetched)
+        profiles.update(fetched)
 
-            auth_list[i]["document_count"] = author["coredata"]["document-count"]
-            auth_list[i]["cited_by_count"] = author["coredata"]["cited-by-count"]
-            auth_list[i]["citation_count"] = author["coredata"]["citation-count"]
-            date_created = author["author-profile"]["date-created"]
-            auth_list[i]["creation_date"] = f"{date_created['@day']}-{date_created['@month']}-{date_created['@year']}"
-            publication_range = author["author-profile"]["publication-range"]
-            start_year = publication_range["@start"]
-            end_year = publication_range["@end"]
-            auth_list[i]["publication_range"] = f"{start_year}-{end_year}"
+        for author in auth_list:
+            author.update(profiles.get(author["auid"], {}))
 
         return auth_list
 
-    @RateLimiter(max_calls=2, period=1)
     def get_openaccess(self, eid: str):
-        url = f"https://api.elsevier.com/content/abstract/eid/{eid}" f"?apiKey=43b38cab54e0a0e4e42667d2998f51e8"
-        headers = {"Accept": "application/json"}
-        response = requests.get(url, headers=headers, timeout=10)
+        # Only the openaccess field of the abstract is requested
+        url = f"{self._api_url}/content/abstract/eid/{eid}?field=openaccess&apiKey={self._api_key}"
+        response = self.stubborn_url_open(url=url)
         return response.json()["abstracts-retrieval-response"]["coredata"]["openaccess"]
 
-    class Entry:
-        def __init__(self, entry, search_query, name):
-            self._title = entry.get("dc:title")
-            self._abstract = entry.get("dc:description")
-            self._keywords = entry.get("authkeywords")
-            self._author = entry.get("dc:creator")
-            self._published_date = entry.get("prism:coverDate")
-            self._eid = entry.get("eid")
-            self._doi = entry.get("prism:doi")
-            self._publication_name = entry.get("prism:publicationName")
-            self._issn = entry.get("prism:issn")
-            self._eissn = entry.get("prism:eIssn")
-            self._type = entry.get("prism:aggregationType")
-            self._sub_type = entry.get("subtypeDescription")
-            self._search_query = search_query
-            self._source = name
-            self._affiliation_country = self._parse_affiliation(entry)
-            self._citedby_count = entry.get("citedby-count")
-
-        def _parse_affiliation(self, entry):
-            try:
-                affiliation_country = entry.get("affiliation")[0].get("affiliation-country")
-                return affiliation_country
-            except TypeError:
-                LOGGER.info(f"The author {self._author} has no affiliation.")
-
-        def to_manuscript(self):
-            m = Manuscript(
-                title=self._title,
-                abstract=self._abstract,
-                keywords=self._keywords,
-                author=self._author,
-                published_date=self._published_date,
-                doi=self._doi,
-                eid=self._eid,
-                publication_name=self._publication_name,
-                issn=self._issn,
-                eissn=self._eissn,
-                type=self._type,
-                sub_type=self._sub_type,
-                search_query=self._search_query,
-                source=self._source,
-                affiliation_country=self._affiliation_country,
-                citedby_count=self._citedby_count,
-            )
-            return m
-
-        def to_document(self):
-            d = Document(
-                title=self._title,
-                abstract=self._abstract,
-                keywords=self._keywords,
-                author=self._author,
-                published_date=datetime.strptime(self._published_date, "%Y-%m-%d"),
-                doi=self._doi,
-                eid=self._eid,
-                publication_name=self._publication_name,
-                issn=self._issn,
-                eissn=self._eissn,
-                type=self._type,
-                sub_type=self._sub_type,
-                search_query=self._search_query,
-                source=self._source,
-                affiliation_country=self._affiliation_country,
-                citedby_count=self._citedby_count,
-            )
-            return d
+    def get_openaccess_by_eids(self, eids: list):
+        # Open access status of up to 25 documents with one search request restricted to eid and openaccess.
+        # Documents missing from the search results are asked one by one to the abstract endpoint
+        query = urllib.parse.quote(" OR ".join(f"EID({eid})" for eid in eids))
+        url = self._base_url + f"query={query}&field=eid,openaccess&count={len(eids)}&apiKey={self._api_key}"
+        response = self.stubborn_url_open(url=url)
+
+        openaccess = {}
+        for entry in response.json()["search-results"].get("entry", []):
+            if entry.get("eid") in eids and entry.get("openaccess") is not None:
+                openaccess[entry["eid"]] = entry["openaccess"]
+        for eid in eids:
+            if eid not in openaccess:
+                openaccess[eid] = self.get_openaccess(eid)
+        return openaccess
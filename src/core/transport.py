@@ -0,0 +1,112 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from core.cache import ResponseCache
+
+LOGGER = logging.getLogger("systematic")
+
+
+class Transport:
+    """
+    HTTP client shared by every remote endpoint of the tool.
+
+    Connections are pooled per host and kept alive between requests, and
+    gzip/deflate encoded bodies are requested and decoded transparently.
+    GET requests are answered from the response cache when one is given.
+    """
+
+    def __init__(self, pool_size: int = 10, timeout: float = 300, cache: ResponseCache = None):
+        """
+        Constructor for the Transport class.
+
+        Parameters:
+        - pool_size: (int) Connections kept alive per host.
+        - timeout: (float) Default timeout of every request, in seconds.
+        - cache: (ResponseCache) On-disk cache of the responses, if any.
+        """
+        self._timeout = timeout
+        self.cache = cache
+        self._session = requests.Session()
+        self._session.headers.update(
+            {
+                "User-Agent": "SurveyRuntime/1.0.0",
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip, deflate",
+                "Connection": "keep-alive",
+            }
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def request(self, method: str, url: str, **kwargs):
+        """
+        Send a request through the pooled session.
+
+        Parameters:
+        - method: (str) HTTP method.
+        - url: (str) Url of the request.
+        - rate_limiter: Limiter acquired before going to the network, cache hits are free.
+        - kwargs: Arguments of requests.Session.request.
+
+        Returns:
+        - requests.Response object, with the body already read.
+        """
+        rate_limiter = kwargs.pop("rate_limiter", None)
+        if method == "GET" and self.cache is not None:
+            response = self.cache.get(url)
+            if response is not None:
+                return response
+
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        kwargs.setdefault("timeout", self._timeout)
+        response = self._session.request(method, url, **kwargs)
+
+        if method == "GET" and self.cache is not None:
+            self.cache.put(url, response)
+        return response
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def close(self):
+        self._session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def configure_transport(**kwargs):
+    """
+    Replace the process-wide transport, e.g. to change its pool size.
+
+    Parameters:
+    - kwargs: Arguments of the Transport constructor.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is not None:
+            _transport.close()
+        _transport = Transport(**kwargs)
+        return _transport
+
+
+def get_transport():
+    """
+    Get the process-wide transport, creating it on first use.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = Transport()
+        return _transport
@@ -3,83 +3,139 @@
 import argparse
 import itertools
 import logging
-import os
-import tempfile
 
 from omegaconf import OmegaConf
 
-from core.crud import SqlAlchemyORM
-from core.database import Database
+from core.cache import ResponseCache
+from core.crud import get_store
+from core.database import configure_database
+from core.enrichment import OpenAccessEnricher, PublisherEnricher
+from core.harvest import Harvester
+from core.planner import QueryPlanner
 from core.plotter import Plotter
+from core.ratelimit import AdaptiveRateLimiter
+from core.resolver import DoiResolver, PrefixHostCache
 from core.scopus import Scopus
-from core.utils import Editorial, Location, Persistence, Sqlite
+from core.transport import configure_transport
+from core.utils import Location
 
 LOGGER = logging.getLogger("systematic")
 
 conf = OmegaConf.load("config.yaml")
-orm = SqlAlchemyORM()
+orm = get_store()
 
 
 def init_database():
-    Database().create_database()
+    orm.db.create_database()
 
 
 def fill_openaccess():
-    s = Sqlite()
-    for eid in list(s.get_empty_openaccess()):
-        LOGGER.info(f"Processing document with eid = {eid}.")
-        scop = Scopus(persistence=Persistence, search_query="None", date_range=conf.date_range)
-        openaccess = scop.get_openaccess(eid=eid)
-        s.set_openaccess(eid=eid, openaccess=openaccess)
+    openaccess = conf.get("openaccess", {})
+    scop = Scopus(persistence=get_store, search_query="None", date_range=conf.date_range)
+    enricher = OpenAccessEnricher(
+        store=orm,
+        scopus=scop,
+        workers=openaccess.get("workers", 4),
+        batch_size=openaccess.get("batch_size", 25),
+    )
+    enricher.run()
 
 
 def fill_editorial():
-    s = Sqlite()
-    e = Editorial()
-    for index, doi in reversed(list(enumerate(s.get_doi()))):
-        try:
-            LOGGER.info(f"Processing document {index} with doi = {doi}.")
-            final_url = e.get_editorial(doi=doi)
-            s.set_doi_eurl(doi=doi, eurl=final_url)
-        except Exception:
-            LOGGER.exception(f"Exception handling document {doi}.")
-
-
-def query_scopus():
-    terms = conf.search_terms
+    editorial = conf.get("editorial", {})
+    rate = editorial.get("rate", 0)
+    prefix = editorial.get("prefix_cache", {})
+    prefix_cache = None
+    if prefix.get("enabled", True):
+        prefix_cache = PrefixHostCache(
+            min_samples=prefix.get("min_samples", 5),
+            min_share=prefix.get("min_share", 0.9),
+            sample_rate=prefix.get("sample_rate", 0.05),
+        )
+    resolver = DoiResolver(
+        resolver_url=editorial.get("resolver_url", "https://doi.org/"),
+        workers=editorial.get("workers", 8),
+        per_host=editorial.get("per_host", 8),
+        rate_limiter=AdaptiveRateLimiter(rate=rate, burst=editorial.get("workers", 8)) if rate else None,
+        prefix_cache=prefix_cache,
+    )
+    resolver.resolve_all(orm.iter_doi(), store=orm, batch_size=editorial.get("batch_size", 200))
+
+
+def fill_publisher():
+    publisher = conf.get("publisher", {})
+    scop = Scopus(
+        persistence=get_store,
+        search_query="None",
+        date_range=conf.date_range,
+        author_store=orm,
+        author_max_age=publisher.get("author_max_age_days", 180),
+        author_batch_size=publisher.get("author_batch_size", 25),
+    )
 
-    search_queries = [
-        f"TITLE-ABS-KEY('{a}' AND '{b}' AND '{c}')" for a, b, c in list(itertools.product(terms[0], terms[1], terms[2]))
-    ]
+    enricher = PublisherEnricher(
+        store=orm,
+        scopus=scop,
+        workers=publisher.get("workers", 4),
+        progress_every=publisher.get("progress_every", 50),
+        prefetch_authors=publisher.get("prefetch_authors", False),
+        prefetch_window=publisher.get("prefetch_window", 1000),
+    )
+    enricher.run()
 
-    for i, s in enumerate(search_queries):
-        LOGGER.info(f"Processing query {i} out of {len(search_queries)}.")
-        LOGGER.info(f"Processing {s}")
-        q = Scopus(persistence=SqlAlchemyORM, search_query=s, date_range=conf.date_range)
-        q.fetch_all()
+    lookups = scop.author_hits + scop.author_misses
+    if lookups:
+        LOGGER.info(
+            f"Author profile store hit rate {scop.author_hits / lookups:.1%}, "
+            f"{scop.author_hits} hits and {scop.author_misses} profiles fetched."
+        )
 
 
-def count_search_queries():
+def search_queries():
     terms = conf.search_terms
+    return [f"TITLE-ABS-KEY('{a}' AND '{b}' AND '{c}')" for a, b, c in itertools.product(terms[0], terms[1], terms[2])]
+
+
+def plan_search_queries():
+    planner = conf.get("planner", {})
+    p = QueryPlanner(
+        store=orm,
+        search_queries=search_queries(),
+        date_range=conf.date_range,
+        workers=planner.get("workers", 4),
+        max_results=planner.get("max_results", 5000),
+        max_age_days=planner.get("max_age_days", 7),
+    )
+    return p.plan()
 
-    search_queries = [
-        f"TITLE-ABS-KEY('{a}' AND '{b}' AND '{c}')" for a, b, c in list(itertools.product(terms[0], terms[1], terms[2]))
-    ]
 
-    total_queries = len(search_queries)
-    LOGGER.info(f"The total amount of search queries are {total_queries}")
+def query_scopus():
+    # Make sure the checkpoint table exists on databases created by older versions
+    init_database()
+
+    harvest = conf.get("harvest", {})
+    plan = None
+    if conf.get("planner", {}).get("enabled", True):
+        plan = plan_search_queries()
+        LOGGER.info(f"Harvest plan:\n{plan}")
+    h = Harvester(
+        persistence=get_store,
+        search_queries=search_queries(),
+        date_range=conf.date_range,
+        workers=harvest.get("workers", 1),
+        batch_size=harvest.get("batch_size", 500),
+        projection=harvest.get("projection", "complete"),
+        parser=harvest.get("parser", None),
+        shards=plan,
+        two_phase=harvest.get("two_phase", False),
+    )
+    h.run()
 
-    filepath = f"{tempfile.gettempdir()}/search_terms_results.csv"
-    if os.path.exists(filepath):
-        os.remove(filepath)
 
-    with open(f"{tempfile.gettempdir()}/search_terms_results.csv", "a") as f:
-        for i, s in enumerate(search_queries):
-            LOGGER.warning(f"Counting elements for query {i} out of {total_queries}.")
-            q = Scopus(persistence=Persistence, search_query=s, date_range=conf.date_range)
-            total_results = q.get_count()
-            LOGGER.info(f"{s} query have {total_results} documents")
-            f.write(str(i) + "," + s + "," + total_results + "\n")
+def count_search_queries():
+    # Make sure the count table exists on databases created by older versions
+    init_database()
+    print(plan_search_queries())
 
 
 def main():
@@ -96,7 +152,7 @@ def main():
         "-c",
         "--count",
         action="store_true",
-        help="Count the documents for each search query.",
+        help="Count the documents for each search query and print the harvest plan.",
         required=False,
     )
 
@@ -191,75 +247,72 @@ def main():
 
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)-8s %(message)s")
 
+    database = conf.get("database", {})
+    configure_database(
+        profile=database.get("profile", "tuned"),
+        pragmas=database.get("pragmas", None),
+        optimize_on_close=database.get("optimize_on_close", True),
+    )
+    orm.chunk_size = database.get("chunk_size", 1000)
+
+    cache = conf.get("cache", {})
+    response_cache = None
+    if cache.get("enabled", False):
+        response_cache = ResponseCache(
+            path=cache.get("path", "http_cache.db"),
+            ttl={name: days * 24 * 3600 for name, days in cache.get("ttl_days", {}).items()},
+            max_bytes=cache.get("max_mb", 512) * 2**20,
+            offline=cache.get("offline", False),
+        )
+    transport = conf.get("transport", {})
+    configure_transport(pool_size=transport.get("pool_size", 10), cache=response_cache)
+    rate_limit = conf.get("rate_limit", {})
+    Scopus.rate_limiter = AdaptiveRateLimiter(
+        rate=rate_limit.get("rate", 1),
+        burst=rate_limit.get("burst", 1),
+        low_watermark=rate_limit.get("low_watermark", 100),
+    )
+
     if args.count:
         count_search_queries()
 
     if args.plot_relations:
         search_terms = conf.search_terms
-        p = Plotter()
+        p = Plotter(store=orm)
         p.relations_diagram(set_1=search_terms[0], set_2=search_terms[1], set_3=search_terms[2])
 
     if args.scopus:
         query_scopus()
 
     if args.plot_bar_country:
-        country_list = orm.get_documents_country()
-        p = Plotter()
-        p.show_country_bar_diagram(country_list=country_list)
+        p = Plotter(store=orm)
+        p.show_country_bar_diagram()
 
     if args.plot_types:
-        document_types = orm.get_documents_type()
-
-        p = Plotter()
-        p.plot_type(document_types=document_types)
+        p = Plotter(store=orm)
+        p.plot_type()
 
     if args.plot_continents:
-        country_list = orm.get_documents_country()
-        p = Plotter()
-        p.plot_geo_continent(documents_per_country=country_list)
+        p = Plotter(store=orm)
+        p.plot_geo_continent()
 
     if args.fill_publisher:
-        scop = Scopus(persistence=Persistence, search_query="None", date_range=conf.date_range)
-
-        eid_list = orm.get_documents_eid()
-        for k in range(len(eid_list)):
-            LOGGER.info(f"Document {k+1}/{len(eid_list)}")
-            authors_list = scop.get_publishers_by_eid(eid_list[k])
-            if authors_list:
-                for i in range(len(authors_list)):
-                    if authors_list[i]["given_name"] is not None and authors_list[i]["surname"] is not None:
-                        complete_name = authors_list[i]["given_name"] + " " + authors_list[i]["surname"]
-                    elif authors_list[i]["given_name"] is not None:
-                        complete_name = authors_list[i]["given_name"]
-                    else:
-                        complete_name = authors_list[i]["surname"]
-
-                    try:
-                        orm.insert_publisher(eid=eid_list[k][0], complete_name=complete_name, author=authors_list[i])
-                    except Exception as e:
-                        LOGGER.info(f"Error={e} inserting the publisher")
+        fill_publisher()
 
     if args.plot_country:
-        country_list = orm.get_documents_country()
-        p = Plotter()
-        p.show_country_map(country_list=country_list)
+        p = Plotter(store=orm)
+        p.show_country_map()
 
     if args.plot_years:
-        document_years = orm.get_documents_year()
-        p = Plotter()
-        p.plot_bar_type(document_years=document_years)
+        p = Plotter(store=orm)
+        p.plot_bar_type()
 
     if args.fill_continent:
         LOGGER.info("About to populate empty continents")
-        s = Sqlite()
-        loc = Location()
-        for affiliation_country in s.get_empty_continents():
-            try:
-                continent = loc.country_to_continent(affiliation_country)
-                tuples = [(affiliation_country, continent)]
-                s.set_continent(tuples=tuples)
-            except KeyError:
-                LOGGER.error(f"Cannot get continent for {affiliation_country}")
+        continents, unresolved = Location().continent_map(orm.get_empty_continents())
+        orm.set_continent(tuples=continents.items())
+        if unresolved:
+            LOGGER.warning(f"Cannot get continent for {len(unresolved)} countries: {', '.join(unresolved)}")
 
     if args.fill_editorial:
         fill_editorial()
@@ -270,6 +323,8 @@ def main():
     if args.init_database:
         init_database()
 
+    orm.db.close()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,10 @@
+import pytest
+
+from core.crud import SqlAlchemyORM
+
+
+@pytest.fixture
+def get_db():
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    return orm
@@ -0,0 +1,82 @@
+import gzip
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer:
+    """
+    Local HTTP/1.1 server emulating the remote APIs in tests and benchmarks.
+
+    Every request is answered by route(method, path), which returns a tuple
+    with the status code, a dict of headers and the body in bytes. Bodies are
+    gzip encoded when the client accepts it. Passing an ssl.SSLContext serves
+    HTTPS instead of plain HTTP, and connect_delay (seconds) emulates the
+    round trips of opening a connection to a remote host.
+    """
+
+    def __init__(self, route, ssl_context=None, connect_delay: float = 0):
+        self.route = route
+        self.connect_delay = connect_delay
+        self._scheme = "https" if ssl_context else "http"
+        self.connections = 0
+        self.requests = []
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Send headers and body in one segment, so delayed ACKs do not stall keep-alive requests
+            wbufsize = 64 * 1024
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+                time.sleep(stub.connect_delay)
+
+            def _answer(self, method):
+                with stub._lock:
+                    stub.requests.append((method, self.path))
+                status, headers, body = stub.route(method, self.path)
+                if body and "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body)
+                    headers = {**headers, "Content-Encoding": "gzip"}
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if method != "HEAD":
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self._answer("GET")
+
+            def do_HEAD(self):
+                self._answer("HEAD")
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        if ssl_context:
+            self._server.socket = ssl_context.wrap_socket(self._server.socket, server_side=True)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"{self._scheme}://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+        return False
@@ -0,0 +1,234 @@
+import json
+import re
+from datetime import date, datetime, timedelta
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from core.crud import SqlAlchemyORM
+from core.enrichment import OpenAccessEnricher, PublisherEnricher
+from core.models import AuthorProfile, Document, StudySelection
+from core.ratelimit import AdaptiveRateLimiter
+from core.scopus import Scopus
+from core.transport import Transport
+from core.utils import Location
+from tests.stub_server import StubServer
+
+
+def fake_profile(auid):
+    return {
+        "document_count": 10,
+        "cited_by_count": 20,
+        "citation_count": 30,
+        "creation_date": "01-01-2020",
+        "publication_range": "2015-2024",
+    }
+
+
+def test_extend_authors_info_reads_author_store(monkeypatch, get_db):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    fetched = []
+
+    def get_author_profiles(self, auids):
+        fetched.extend(auids)
+        return {auid: fake_profile(auid) for auid in auids}
+
+    monkeypatch.setattr(Scopus, "get_author_profiles", get_author_profiles)
+    scop = Scopus(persistence=None, search_query="None", date_range="2020", author_store=get_db, author_max_age=30)
+
+    authors = scop.extend_authors_info([{"auid": "1"}, {"auid": "2"}])
+    assert authors[0]["document_count"] == 10
+    scop.extend_authors_info([{"auid": "1"}, {"auid": "3"}])
+    assert sorted(fetched) == ["1", "2", "3"]
+    assert (scop.author_hits, scop.author_misses) == (1, 3)
+
+    # Stale profiles are fetched again
+    with get_db.db.get_session() as sess:
+        sess.get(AuthorProfile, "1").fetched_at = datetime.now() - timedelta(days=31)
+        sess.commit()
+    scop.prefetch_author_profiles(["1", "2", "3", None])
+    assert sorted(fetched) == ["1", "1", "2", "3"]
+
+
+def author_response(auid):
+    return {
+        "coredata": {
+            "dc:identifier": f"AUTHOR_ID:{auid}",
+            "document-count": auid,
+            "cited-by-count": "20",
+            "citation-count": "30",
+        },
+        "author-profile": {
+            "date-created": {"@day": "01", "@month": "02", "@year": "2010"},
+            "publication-range": {"@start": "2010", "@end": "2024"},
+        },
+    }
+
+
+def multi_author_route(method, path):
+    # Emulate the multi-ID author retrieval, which answers in another order and a single author unwrapped
+    auids = parse_qs(urlsplit(path).query)["author_id"][0].split(",")
+    authors = [author_response(auid) for auid in reversed(auids) if auid not in ("404", "500", "501")]
+    # Error entries come without coredata, and incomplete ones without an author profile
+    if "500" in auids:
+        authors.append({"@status": "error", "error": "Author 500 is unavailable"})
+    if "501" in auids:
+        authors.append({"coredata": {"dc:identifier": "AUTHOR_ID:501"}})
+    body = {
+        "author-retrieval-response-list": {"author-retrieval-response": authors[0] if len(authors) == 1 else authors}
+    }
+    return 200, {"Content-Type": "application/json"}, json.dumps(body).encode()
+
+
+def test_get_author_profiles_batches_author_ids(monkeypatch):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    with StubServer(multi_author_route) as stub:
+        scop = Scopus(
+            persistence=None,
+            search_query="None",
+            date_range="2020",
+            transport=Transport(),
+            author_batch_size=3,
+            api_url=stub.url,
+        )
+        profiles = scop.get_author_profiles(["1", "2", "3", "4", "404", "6", "7", "500", "501"])
+        assert [path for _, path in stub.requests] == [
+            "/content/author?author_id=1,2,3&apiKey=key",
+            "/content/author?author_id=4,404,6&apiKey=key",
+            "/content/author?author_id=7,500,501&apiKey=key",
+        ]
+
+    assert sorted(profiles) == ["1", "2", "3", "4", "6", "7"]
+    assert profiles["7"]["document_count"] == "7"
+    assert profiles["7"]["creation_date"] == "01-02-2010"
+    assert profiles["7"]["publication_range"] == "2010-2024"
+
+
+def test_publisher_enricher_resumes_documents_without_publishers(monkeypatch, tmp_path):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    # Pages of 2 documents, read while the publishers are committed
+    orm = SqlAlchemyORM(str(tmp_path / "documents.db"), chunk_size=2)
+    orm.db.create_database()
+    orm.save_bulk([Document(title=f"Title{i}", published_date=date(2022, 1, 1), eid=f"EID{i}") for i in range(11)])
+
+    read, fetched = [], []
+    iter_eids = orm.iter_eids_without_publisher
+
+    def iter_eids_without_publisher(*args):
+        for eid in iter_eids(*args):
+            read.append(eid)
+            yield eid
+
+    def get_publishers_by_eid(self, eid):
+        fetched.append(eid)
+        # The documents are read as they are submitted, at most 2 per worker ahead of the fetches
+        assert len(read) <= len(fetched) + 6
+        if eid == "EID3" and fetched.count(eid) == 1:
+            raise ValueError("Interrupted")
+        if eid == "EID10":
+            # A document without authors is enriched too
+            return []
+        author = {"given_name": "Ada", "surname": eid, "auid": eid, "country": "Spain", "city": "Madrid"}
+        return [{**author, **fake_profile(eid)}, {**author, "given_name": None, **fake_profile(eid)}]
+
+    monkeypatch.setattr(Scopus, "get_publishers_by_eid", get_publishers_by_eid)
+    monkeypatch.setattr(orm, "iter_eids_without_publisher", iter_eids_without_publisher)
+    scop = Scopus(persistence=None, search_query="None", date_range="2020")
+
+    assert PublisherEnricher(orm, scop, workers=3).run() == (10, 18)
+    assert orm.get_eids_without_publisher() == ["EID3"]
+
+    # A second run only enriches the document that failed
+    assert PublisherEnricher(orm, scop, workers=3).run() == (1, 2)
+    assert sorted(fetched) == sorted([f"EID{i}" for i in range(11)] + ["EID3"])
+    assert orm.get_eids_without_publisher() == []
+
+
+def test_publisher_enricher_prefetches_every_profile_once(monkeypatch, tmp_path):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    orm = SqlAlchemyORM(str(tmp_path / "documents.db"), chunk_size=2)
+    orm.db.create_database()
+    orm.save_bulk([Document(title=f"Title{i}", eid=f"EID{i}") for i in range(6)])
+    requested = []
+
+    def get_authors_by_eid(self, eid):
+        if eid == "EID5":
+            raise ValueError("Unavailable")
+        # Every document shares the author 0 with the others
+        authors = [
+            {"given_name": "Ada", "surname": auid, "auid": auid, "country": "Spain", "city": "Madrid"}
+            for auid in ("0", eid)
+        ]
+        return authors
+
+    def get_author_profiles(self, auids):
+        if auids:
+            requested.append(sorted(auids))
+        return {auid: fake_profile(auid) for auid in auids}
+
+    monkeypatch.setattr(Scopus, "get_authors_by_eid", get_authors_by_eid)
+    monkeypatch.setattr(Scopus, "get_author_profiles", get_author_profiles)
+    monkeypatch.setattr(Scopus, "get_publishers_by_eid", lambda self, eid: [])
+    scop = Scopus(persistence=None, search_query="None", date_range="2020", author_store=orm, author_max_age=30)
+
+    enricher = PublisherEnricher(orm, scop, workers=2, prefetch_authors=True, prefetch_window=4)
+    assert enricher.run() == (6, 10)
+    # One request for the distinct authors of every window, and the documents read the profiles from the store
+    assert requested == [["0", "EID0", "EID1", "EID2", "EID3"], ["EID4"]]
+    assert scop.author_hits == 10
+
+
+def test_continent_map_resolves_scopus_aliases(get_db):
+    countries = ["Spain", "Spain", "Cote d'Ivoire", "Timor-Leste", "Viet Nam", "Undefined", None]
+    get_db.save_bulk(
+        [Document(title=f"Title{i}", eid=f"EID{i}", affiliation_country=c) for i, c in enumerate(countries)]
+    )
+
+    continents, unresolved = Location().continent_map(get_db.get_empty_continents())
+    assert continents == {"Spain": "Europe", "Cote d'Ivoire": "Africa", "Timor-Leste": "Asia", "Viet Nam": "Asia"}
+    assert unresolved == ["Undefined"]
+
+    get_db.set_continent(tuples=continents.items())
+    assert get_db.get_empty_continents() == ["Undefined"]
+
+
+def openaccess_route(method, path):
+    url = urlsplit(path)
+    if url.path.startswith("/content/abstract/eid/"):
+        body = {"abstracts-retrieval-response": {"coredata": {"openaccess": "0"}}}
+    else:
+        # The search leaves out the last EID of every batch, so it is asked to the abstract endpoint
+        query = parse_qs(url.query)
+        assert query["field"] == ["eid,openaccess"]
+        eids = re.findall(r"EID\((.*?)\)", unquote(query["query"][0]))
+        body = {"search-results": {"entry": [{"eid": eid, "openaccess": "1"} for eid in eids[:-1]]}}
+    return 200, {"Content-Type": "application/json"}, json.dumps(body).encode()
+
+
+def test_openaccess_enricher_batches_eids(monkeypatch, tmp_path):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    orm = SqlAlchemyORM(str(tmp_path / "documents.db"), chunk_size=3)
+    orm.db.create_database()
+    orm.save_bulk([Document(title=f"Title{i}", eid=f"EID{i}") for i in range(12)])
+    with orm.db.get_session() as sess:
+        sess.add_all(StudySelection(id_document=i + 1, status=3 if i < 10 else 1) for i in range(12))
+        sess.commit()
+
+    with StubServer(openaccess_route) as stub:
+        scop = Scopus(
+            persistence=None,
+            search_query="None",
+            date_range="2020",
+            rate_limiter=AdaptiveRateLimiter(rate=100, burst=10),
+            transport=Transport(),
+            api_url=stub.url,
+        )
+        assert OpenAccessEnricher(orm, scop, workers=2, batch_size=4).run() == 10
+        paths = [urlsplit(path).path for _, path in stub.requests]
+        assert paths.count("/content/search/scopus") == 3
+        assert paths.count("/content/abstract/eid/EID3") == 1
+
+    assert orm.get_empty_openaccess() == []
+    with orm.db.get_session() as sess:
+        openaccess = dict(sess.query(Document.eid, Document.openaccess))
+    assert openaccess["EID0"] == "1"
+    assert openaccess["EID3"] == "0"
+    assert openaccess["EID11"] is None
@@ -1,12 +1,16 @@
 # import unittest
 # from unittest.mock import Mock, patch
 
+import threading
 from datetime import date
 
-import pytest
+from sqlalchemy import event, select
 
-from core.crud import SqlAlchemyORM
+from core.crud import SqlAlchemyORM, configure_store, get_store
+from core.database import PROFILES, Database
+from core.migrations import SCHEMA_VERSION, schema_version
 from core.models import Document
+from core.parsing import document_row
 
 # from src.core.models import DoiEurl
 
@@ -15,13 +19,6 @@ from core.models import Document
 # LOGGER.setLevel(logging.ERROR)
 
 
-@pytest.fixture
-def get_db():
-    orm = SqlAlchemyORM(":memory:")
-    orm.db.create_database()
-    return orm
-
-
 def test_get_session(get_db):
     session = get_db.db.get_session()
     assert session is not None
@@ -52,6 +49,214 @@ def test_save(get_db):
     get_db.save(documents)
 
 
+def test_save_bulk_skips_duplicates(get_db):
+    documents = [
+        Document(title=f"Title{i}", published_date=date(2022, 1, 1), doi=f"DOI{i % 3}", eid=f"EID{i}") for i in range(5)
+    ]
+    assert get_db.save_bulk(documents, batch_size=2) == (3, 2)
+    assert get_db.save_bulk(documents[:1]) == (0, 1)
+    assert len(get_db.get_documents_eid()) == 3
+
+
+def test_save_rows_uses_document_columns(get_db):
+    entries = [
+        {"dc:title": f"Title{i}", "prism:coverDate": "2022-01-02", "eid": f"EID{i % 2}", "citedby-count": "3"}
+        for i in range(3)
+    ]
+    rows = [document_row(entry, "Query", "Scopus") for entry in entries]
+    assert get_db.save_rows(rows, batch_size=2) == (2, 1)
+    with get_db.db.get_session() as sess:
+        document = sess.query(Document).filter_by(eid="EID1").one()
+    assert (document.title, document.published_date, document.citedby_count) == ("Title1", date(2022, 1, 2), 3)
+
+
+def test_links_keep_every_matching_query(get_db):
+    rows = [document_row({"eid": f"EID{i}"}, query, "Scopus") for query, n in (("a", 3), ("b", 2)) for i in range(n)]
+    rows.append(document_row({"eid": "EID9"}, "c", "Scopus"))
+    assert get_db.save_rows(rows) == (4, 2)
+
+    assert get_db.get_document_queries("EID1") == ["a", "b"]
+    assert get_db.get_query_overlap() == [("a", 3, 1, 2), ("b", 2, 0, 2), ("c", 1, 1, 0)]
+
+    with get_db.db.engine.connect() as conn:
+        plan = conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN SELECT eid FROM document_query WHERE search_query = 'a'"
+        ).fetchall()
+    assert "ix_document_query_search_query" in str(plan)
+
+
+def test_links_are_backfilled_from_documents(tmp_path):
+    orm = SqlAlchemyORM(str(tmp_path / "documents.db"))
+    orm.db.create_database()
+    orm.save_bulk([Document(eid="EID1", search_query="a"), Document(eid="EID2", search_query="b")])
+    with orm.db.engine.begin() as conn:
+        conn.exec_driver_sql("DROP VIEW query_overlap")
+        conn.exec_driver_sql("DROP TABLE document_query")
+        conn.exec_driver_sql("PRAGMA user_version = 0")
+
+    orm.db.create_database()
+    assert orm.get_query_overlap() == [("a", 1, 1, 0), ("b", 1, 1, 0)]
+
+
+def test_tuned_profile_pragmas(tmp_path):
+    db = Database(str(tmp_path / "documents.db"), pragmas=PROFILES["tuned"], optimize_on_close=True)
+    db.create_database()
+    with db.engine.connect() as conn:
+        pragmas = {name: conn.exec_driver_sql(f"PRAGMA {name}").scalar() for name in PROFILES["tuned"]}
+    db.close()
+    assert pragmas == {
+        "journal_mode": "wal",
+        "synchronous": 1,
+        "mmap_size": 256 * 2**20,
+        "cache_size": -64 * 1024,
+        "temp_store": 2,
+        "busy_timeout": 5000,
+    }
+
+
+def query_plan(orm, method, *args):
+    # Plans of the selects run by a method of the store
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(orm.db.engine, "before_cursor_execute", capture)
+    try:
+        method(*args)
+    finally:
+        event.remove(orm.db.engine, "before_cursor_execute", capture)
+    with orm.db.engine.connect() as conn:
+        return " ".join(
+            row[-1]
+            for sql, parameters in statements
+            for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", parameters)
+        )
+
+
+def test_migrations_add_indexes_to_existing_databases(tmp_path):
+    orm = SqlAlchemyORM(str(tmp_path / "documents.db"))
+    orm.db.create_database()
+    # Databases created by older versions have neither the secondary indexes nor a version
+    with orm.db.engine.begin() as conn:
+        indexes = conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'")
+        for (name,) in indexes.fetchall():
+            if not name.startswith("ix_document_query"):
+                conn.exec_driver_sql(f"DROP INDEX {name}")
+        conn.exec_driver_sql("PRAGMA user_version = 0")
+    assert "ix_documents_sub_type" not in query_plan(orm, orm.count_by_sub_type)
+
+    orm.db.create_database()
+    with orm.db.engine.connect() as conn:
+        assert schema_version(conn) == SCHEMA_VERSION
+        indexes = {name for (name,) in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert not {"ix_documents_issn", "ix_documents_eissn"} & indexes
+
+    # The queries of the store use the indexes
+    plans = [
+        ("ix_documents_sub_type", orm.count_by_sub_type),
+        ("ix_documents_published_date", orm.count_by_year),
+        ("ix_documents_affiliation_country", orm.count_by_country),
+        ("ix_documents_affiliation_country", orm.get_empty_continents),
+        ("ix_publisher_id_document", orm.get_eids_without_publisher),
+        ("ix_studyselection_id_document", orm.set_status_studyselection, 1, 3),
+        ("sqlite_autoindex_documents_1 (doi>?)", orm.get_doi),
+    ]
+    for index, method, *args in plans:
+        assert index in query_plan(orm, method, *args), method.__name__
+    # Every document with an ISSN is read by the anti-joins of the publishers, an index would not help them
+    assert query_plan(orm, orm.get_all_issn_without_publisher).startswith("SCAN documents")
+    assert query_plan(orm, orm.get_all_eissn_without_publisher).startswith("SCAN documents")
+
+
+def test_in_memory_store_is_shared_by_threads():
+    store = configure_store(":memory:")
+    try:
+        assert get_store() is store
+        store.db.create_database()
+        rows = [
+            document_row({"eid": f"EID{i}", "affiliation": [{"affiliation-country": "Spain"}]}, "q", "Scopus")
+            for i in range(5)
+        ]
+        writer = threading.Thread(target=store.save_rows, args=(rows,))
+        writer.start()
+        writer.join()
+
+        statement = select(Document.eid).order_by(Document.eid)
+        assert [row.eid for row in store.stream(statement, chunk_size=2)] == [f"EID{i}" for i in range(5)]
+
+        store.set_publisher_by_issn("1234-5678", "Elsevier")
+        store.set_publisher_by_issn("1234-5678", "Springer")
+        assert store.get_publisher_by_issn("1234-5678")["publisher"] == "Elsevier"
+    finally:
+        configure_store()
+
+
+def test_in_memory_store_serializes_threads(get_db):
+    errors = []
+
+    def work(thread):
+        try:
+            for i in range(20):
+                rows = [
+                    document_row({"eid": f"EID{thread}-{i}-{j}", "prism:doi": f"DOI{thread}-{i}-{j}"}, "q", "Scopus")
+                    for j in range(10)
+                ]
+                get_db.save_rows(rows)
+                # A stream left open while the other threads commit
+                assert len(list(get_db.iter_documents_eid(chunk_size=7))) >= 10
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=work, args=(thread,)) for thread in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(get_db.get_documents_eid()) == 6 * 20 * 10
+
+
+def test_streaming_reads_match_lists(get_db):
+    get_db.save_bulk(
+        [Document(eid=f"EID{i}", doi=f"DOI{i}", issn="1234", affiliation_country="Spain") for i in range(7)]
+    )
+    get_db.set_publisher_by_issn("1234", "Elsevier")
+    get_db.save_bulk([Document(eid="EID9", issn="5678", affiliation_country=None)])
+
+    assert list(get_db.iter_documents_country(chunk_size=2)) == get_db.get_documents_country()
+    assert list(get_db.iter_documents_eid(chunk_size=3)) == get_db.get_documents_eid()
+    assert list(get_db.iter_doi(chunk_size=2)) == [f"DOI{i}" for i in range(7)]
+    assert get_db.get_empty_publisher() == [(8, "EID9", "5678", None)]
+
+
+def test_aggregates_group_in_sql(get_db):
+    countries = ["Spain", "Spain", "Germany", "Japan", None]
+    get_db.save_bulk(
+        [
+            Document(
+                eid=f"EID{i}",
+                affiliation_country=country,
+                published_date=date(2020 + i % 2, 1, 1),
+                sub_type="Article" if i else "Review",
+                issn="1111" if i < 2 else None,
+                eissn="2222",
+            )
+            for i, country in enumerate(countries)
+        ]
+    )
+    get_db.set_continent([("Spain", "Europe"), ("Germany", "Europe")])
+    get_db.set_publisher_by_issn("1111", "Elsevier")
+    get_db.set_publisher_by_eissn("2222", "Springer")
+
+    assert get_db.count_by_country() == [("Spain", 2), ("Germany", 1), ("Japan", 1)]
+    assert get_db.count_by_continent() == [("Europe", 3)]
+    assert get_db.count_by_year() == [("2020", 3), ("2021", 2)]
+    assert get_db.count_by_sub_type() == [("Article", 4), ("Review", 1)]
+    assert get_db.count_by_publisher() == [("Springer", 3), ("Elsevier", 2)]
+
+
 def test_get_documents_country(get_db):
     get_db.get_documents_country()
 
@@ -0,0 +1,371 @@
+import json
+import random
+import time
+import urllib.parse
+from types import SimpleNamespace
+
+import pytest
+
+from core.crud import SqlAlchemyORM
+from core.harvest import Harvester
+from core.models import Document
+from core.parsing import available_parsers
+from core.planner import QueryPlanner, split_years
+from core.ratelimit import AdaptiveRateLimiter
+from core.scopus import Scopus
+from core.transport import Transport
+from tests.stub_server import StubServer
+
+PAGES = 4
+
+
+def fake_search_page(url):
+    # Each query returns PAGES pages of two entries, overlapping with the other queries
+    params = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    query = params["query"][0]
+    page = int(params.get("page", ["0"])[-1])
+    time.sleep(random.uniform(0, 0.01))
+    entries = [
+        {
+            "dc:title": f"{query} {page} {i}",
+            "prism:coverDate": "2020-01-01",
+            "eid": f"2-s2.0-{(len(query) + page * 2 + i) % 7}",
+            "affiliation": [{"affiliation-country": "Spain"}],
+        }
+        for i in range(2)
+    ]
+    links = [{"@ref": "next", "@href": f"{url}&page={page + 1}"}] if page + 1 < PAGES else []
+    body = {"search-results": {"entry": entries, "link": links}}
+    return SimpleNamespace(content=json.dumps(body).encode())
+
+
+@pytest.fixture
+def scopus_stub(monkeypatch):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    monkeypatch.setattr(Scopus, "stubborn_url_open", lambda self, url, **kwargs: fake_search_page(url))
+
+
+def stored(orm):
+    with orm.db.get_session() as sess:
+        return sess.query(Document.eid, Document.search_query).order_by(Document.id_document).all()
+
+
+def test_harvester_matches_sequential_run(scopus_stub):
+    queries = ["a", "bb", "ccc", "dddd"]
+    limiter = AdaptiveRateLimiter(rate=1000, burst=1000)
+
+    sequential = SqlAlchemyORM(":memory:")
+    sequential.db.create_database()
+    for s in queries:
+        Scopus(persistence=lambda: sequential, search_query=s, date_range="2020", rate_limiter=limiter).fetch_all()
+
+    concurrent = SqlAlchemyORM(":memory:")
+    concurrent.db.create_database()
+    h = Harvester(lambda: concurrent, queries, "2020", workers=3, rate_limiter=limiter, buffered_pages=1)
+    h.run()
+
+    # The same documents and links, each document stored with the first query that matched it
+    assert sorted(stored(concurrent)) == sorted(stored(sequential))
+    for eid, _ in stored(concurrent):
+        assert concurrent.get_document_queries(eid) == sequential.get_document_queries(eid)
+    assert h.stats["fetch"].items == len(queries) * PAGES
+    assert h.stats["write"].items == len(queries) * PAGES * 2
+
+
+def test_harvester_does_not_hold_short_queries_behind_long_ones(monkeypatch):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    pages = {"long": 40, "short": 10}
+    fetched = []
+
+    def search_page(self, url, **kwargs):
+        params = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+        query, page = params["query"][0], int(params.get("page", ["0"])[-1])
+        time.sleep(0.002)
+        fetched.append((query, page))
+        entries = [{"eid": f"2-s2.0-{query}-{page}"}]
+        links = [{"@ref": "next", "@href": f"{url}&page={page + 1}"}] if page + 1 < pages[query] else []
+        return SimpleNamespace(content=json.dumps({"search-results": {"entry": entries, "link": links}}).encode())
+
+    monkeypatch.setattr(Scopus, "stubborn_url_open", search_page)
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    limiter = AdaptiveRateLimiter(rate=1000, burst=1000)
+    Harvester(lambda: orm, ["long", "short"], "2020", workers=2, rate_limiter=limiter, buffered_pages=2).run()
+
+    # With two pages of buffer, the short query still runs to its end while the long one is fetched
+    assert fetched.index(("short", 9)) < fetched.index(("long", 39))
+    assert orm.get_checkpoint("long", "2020")["pages"] == 40
+    assert orm.get_checkpoint("short", "2020")["pages"] == 10
+
+
+def test_harvester_resumes_from_checkpoint(monkeypatch, scopus_stub):
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    limiter = AdaptiveRateLimiter(rate=1000, burst=1000)
+    fetched = []
+
+    def failing_page(self, url, **kwargs):
+        fetched.append(url)
+        if len(fetched) == 3:
+            raise TimeoutError("connection lost")
+        return fake_search_page(url)
+
+    monkeypatch.setattr(Scopus, "stubborn_url_open", failing_page)
+    with pytest.raises(TimeoutError):
+        Harvester(lambda: orm, ["a"], "2020", workers=1, rate_limiter=limiter, batch_size=1).run()
+    checkpoint = orm.get_checkpoint("a", "2020")
+    assert checkpoint["pages"] == 2
+    assert "apiKey" not in checkpoint["next_link"]
+
+    fetched.clear()
+    Harvester(lambda: orm, ["a"], "2020", workers=1, rate_limiter=limiter, batch_size=1).run()
+    assert len(fetched) == PAGES - 2
+    assert orm.get_checkpoint("a", "2020")["complete"]
+
+    fetched.clear()
+    Scopus(persistence=lambda: orm, search_query="a", date_range="2020").fetch_all()
+    assert fetched == []
+
+
+def test_projection_restricts_search_fields(monkeypatch):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+
+    def params(projection):
+        url = Scopus(persistence=None, search_query="a", date_range="2020", projection=projection).first_link()
+        return {k: v[-1] for k, v in urllib.parse.parse_qs(urllib.parse.urlsplit(url).query).items()}
+
+    assert "field" not in params("complete")
+    assert params("fields")["view"] == "COMPLETE"
+    assert "dc:description" in params("fields")["field"].split(",")
+    assert (params("standard")["view"], params("standard")["count"]) == ("STANDARD", "200")
+    assert "dc:description" not in params("standard")["field"].split(",")
+    with pytest.raises(ValueError):
+        params("minimal")
+
+
+@pytest.mark.parametrize("parser", available_parsers())
+def test_fetch_rows_streams_from_socket(monkeypatch, parser):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    page = fake_search_page("https://api.elsevier.com/content/search/scopus?query=abc&page=2").content
+
+    with StubServer(lambda method, path: (200, {"Content-Type": "application/json"}, page)) as stub:
+        limiter = AdaptiveRateLimiter(rate=1000, burst=1000)
+        q = Scopus(None, "abc", "2020", rate_limiter=limiter, transport=Transport(), api_url=stub.url, parser=parser)
+        for _ in range(3):
+            rows, next_link = q.fetch_rows(q.first_link())
+        assert stub.connections == 1
+
+    assert [row.eid for row in rows] == [e["eid"] for e in json.loads(page)["search-results"]["entry"]]
+    assert rows[0].affiliation_country == "Spain"
+    assert next_link.endswith("&page=3")
+
+
+@pytest.mark.parametrize("parser", available_parsers())
+@pytest.mark.parametrize("two_phase", [False, True])
+def test_harvester_skips_empty_result_pages(monkeypatch, parser, two_phase):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    body = {"search-results": {"opensearch:totalResults": "0", "entry": [{"error": "Result set was empty"}]}}
+    page = json.dumps(body).encode()
+    monkeypatch.setattr(Scopus, "stubborn_url_open", lambda self, url, **kwargs: SimpleNamespace(content=page))
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    limiter = AdaptiveRateLimiter(rate=1000, burst=1000)
+    h = Harvester(lambda: orm, ["a", "b"], "2020", rate_limiter=limiter, parser=parser, two_phase=two_phase)
+    assert h.run() == (0, 0)
+
+    with orm.db.engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT count(*) FROM documents").scalar() == 0
+        assert conn.exec_driver_sql("SELECT count(*) FROM document_query").scalar() == 0
+
+
+def test_planner_shards_large_queries_by_year(monkeypatch, scopus_stub):
+    totals = {("small", "2018-2020"): 10, ("none", "2018-2020"): 0, ("large", "2018-2020"): 9000}
+    totals.update({("large", "2018"): 2000, ("large", "2019"): 0, ("large", "2020"): 7000})
+    requested = []
+
+    def count_page(self, url, **kwargs):
+        params = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+        requested.append((params["query"][0], params["date"][0]))
+        body = {"search-results": {"opensearch:totalResults": str(totals[requested[-1]])}}
+        return SimpleNamespace(content=json.dumps(body).encode())
+
+    monkeypatch.setattr(Scopus, "stubborn_url_open", count_page)
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    limiter = AdaptiveRateLimiter(rate=1000, burst=1000)
+
+    planner = QueryPlanner(orm, ["small", "none", "large"], "2018-2020", rate_limiter=limiter)
+    plan = planner.plan()
+    assert [tuple(shard) for shard in plan] == [
+        ("large", "2020", 7000),
+        ("large", "2018", 2000),
+        ("small", "2018-2020", 10),
+    ]
+    assert plan.totals == {"small": 10, "none": 0, "large": 9000}
+    assert "3 shards of 2 search queries, 9010 results" in str(plan)
+    assert sorted(requested) == sorted(totals)
+
+    # The counts are stored, so planning again requests nothing
+    requested.clear()
+    again = QueryPlanner(orm, ["small", "none", "large"], "2018-2020", rate_limiter=limiter).plan()
+    assert again.shards == plan.shards
+    assert requested == []
+
+
+def test_harvester_runs_plan_shards(scopus_stub):
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    shards = [("a", "2019", 8), ("a", "2020", 8), ("bb", "2018-2022", 8)]
+    h = Harvester(lambda: orm, [], "2018-2022", rate_limiter=AdaptiveRateLimiter(rate=1000, burst=1000), shards=shards)
+    h.run()
+
+    assert h.stats["fetch"].items == len(shards) * PAGES
+    for s, date_range, _ in shards:
+        assert orm.get_checkpoint(s, date_range)["complete"]
+
+
+def test_split_years():
+    assert split_years("2018-2020") == ["2018", "2019", "2020"]
+    assert split_years("2020") == ["2020"]
+
+
+def test_harvester_resumes_whole_range_before_the_plan_split(monkeypatch, scopus_stub):
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    limiter = AdaptiveRateLimiter(rate=1000, burst=1000)
+    fetched, failures = [], [TimeoutError("connection lost")]
+
+    def failing_page(self, url, **kwargs):
+        fetched.append(url)
+        if len(fetched) == 3 and failures:
+            raise failures.pop()
+        return fake_search_page(url)
+
+    monkeypatch.setattr(Scopus, "stubborn_url_open", failing_page)
+    with pytest.raises(TimeoutError):
+        Harvester(lambda: orm, ["a"], "2018-2022", workers=1, rate_limiter=limiter, batch_size=1).run()
+
+    # The planner splits the query afterwards, and the harvest goes on from its checkpoint
+    fetched.clear()
+    shards = [("a", "2019", 8), ("a", "2020", 8), ("bb", "2018-2022", 8)]
+    Harvester(lambda: orm, ["a", "bb"], "2018-2022", rate_limiter=limiter, batch_size=1, shards=shards).run()
+    assert sum("query=a" in url for url in fetched) == PAGES - 2
+    assert orm.get_checkpoint("a", "2018-2022")["complete"]
+    assert orm.get_checkpoint("a", "2019") is None
+    assert orm.get_checkpoint("bb", "2018-2022")["complete"]
+
+
+def overlap_search(matches: dict, requested: list, missing: tuple = (), doi: dict = None):
+    # Search stub of the queries in matches, which answers the EID(...) OR ... searches too, leaving out
+    # the missing EIDs and giving the EIDs in doi the DOI of another one
+    doi = doi or {}
+
+    def search_page(self, url, **kwargs):
+        params = {k: v[-1] for k, v in urllib.parse.parse_qs(urllib.parse.urlsplit(url).query).items()}
+        requested.append(params)
+        if params["query"].startswith("EID("):
+            eids = [term[4:-1] for term in params["query"].split(" OR ") if term[4:-1] not in missing]
+            links = []
+        else:
+            start = 0 if params["cursor"] == "*" else int(params["cursor"])
+            count = int(params["count"])
+            eids = matches[params["query"]][start : start + count]
+            total = len(matches[params["query"]])
+            links = [{"@ref": "next", "@href": f"{url}&cursor={start + count}"}] if start + count < total else []
+        fields = params.get("field", "").split(",")
+        entries = [
+            {"eid": eid, "dc:title": None if "dc:title" not in fields else eid, "prism:doi": doi.get(eid, eid)}
+            for eid in eids
+        ]
+        body = {"search-results": {"entry": entries, "link": links}}
+        return SimpleNamespace(content=json.dumps(body).encode())
+
+    return search_page
+
+
+def test_two_phase_harvest_fetches_overlapping_documents_once(monkeypatch):
+    # Query i matches the documents i to i + 5, so consecutive queries share most of them
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    matches = {f"q{i}": [f"2-s2.0-{d}" for d in range(i, i + 6)] for i in range(4)}
+    requested = []
+    monkeypatch.setattr(Scopus, "stubborn_url_open", overlap_search(matches, requested))
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    h = Harvester(
+        lambda: orm,
+        list(matches),
+        "2020",
+        rate_limiter=AdaptiveRateLimiter(rate=1000, burst=1000),
+        projection="fields",
+        two_phase=True,
+    )
+    assert h.run() == (9, 0)
+
+    eid_pages = [r for r in requested if not r["query"].startswith("EID(")]
+    assert all(r["field"] == "eid" and r["count"] == "200" for r in eid_pages)
+    fetched = [eid for r in requested if r["query"].startswith("EID(") for eid in r["query"].split(" OR ")]
+    assert len(fetched) == 9
+    assert h.matched == 24 and h.linked == 24
+
+    with orm.db.get_session() as sess:
+        assert sorted(sess.query(Document.title).all()) == sorted((f"2-s2.0-{d}",) for d in range(9))
+        assert dict(sess.query(Document.eid, Document.search_query).all())["2-s2.0-3"] == "q0"
+    assert orm.get_unfetched_eids() == {}
+
+
+@pytest.mark.parametrize("two_phase", [False, True])
+def test_harvester_stores_documents_with_first_matching_query(monkeypatch, two_phase):
+    # Query i matches the documents 0 to 2i + 1, and the later queries answer first
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    matches = {f"q{i}": [f"2-s2.0-{d}" for d in range(2 * i + 2)] for i in range(4)}
+    search = overlap_search(matches, [])
+
+    def slow_search(self, url, **kwargs):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)["query"][0]
+        if query in matches:
+            time.sleep(0.02 * (len(matches) - int(query[1:])))
+        return search(self, url, **kwargs)
+
+    monkeypatch.setattr(Scopus, "stubborn_url_open", slow_search)
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    limiter = AdaptiveRateLimiter(rate=1000, burst=1000)
+    h = Harvester(
+        lambda: orm,
+        list(matches),
+        "2020",
+        workers=4,
+        rate_limiter=limiter,
+        batch_size=1,
+        projection="fields",
+        two_phase=two_phase,
+    )
+    assert h.run()[0] == 8
+    assert dict(stored(orm)) == {f"2-s2.0-{d}": f"q{d // 2}" for d in range(8)}
+
+
+def test_two_phase_harvest_requests_every_eid_once(monkeypatch):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    matches = {"q0": [f"2-s2.0-{d}" for d in range(4)], "q1": [f"2-s2.0-{d}" for d in range(2, 8)]}
+    requested = []
+    # 2-s2.0-6 shares the DOI of 2-s2.0-5 and Scopus does not return 2-s2.0-7
+    search = overlap_search(matches, requested, missing=("2-s2.0-7",), doi={"2-s2.0-6": "2-s2.0-5"})
+    monkeypatch.setattr(Scopus, "stubborn_url_open", search)
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+
+    def harvester(queries, two_phase):
+        limiter = AdaptiveRateLimiter(rate=1000, burst=1000)
+        return Harvester(lambda: orm, queries, "2020", rate_limiter=limiter, projection="fields", two_phase=two_phase)
+
+    # A query harvested in one phase is still linked by a two-phase harvest
+    assert harvester(["q0"], False).run() == (4, 0)
+    assert orm.get_document_queries("2-s2.0-0") == ["q0"]
+    requested.clear()
+    assert harvester(["q0", "q1"], True).run() == (2, 1)
+    assert {r["query"] for r in requested if r.get("field") == "eid"} == {"q0", "q1"}
+    assert orm.get_unfetched_eids() == {}
+
+    requested.clear()
+    assert harvester(["q0", "q1"], True).run() == (0, 0)
+    assert not [r for r in requested if r["query"].startswith("EID(")]
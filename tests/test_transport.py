@@ -0,0 +1,261 @@
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+from core.cache import CacheMiss, ResponseCache
+from core.crud import SqlAlchemyORM
+from core.parsing import document_row
+from core.ratelimit import AdaptiveRateLimiter
+from core.resolver import DoiResolver, PrefixHostCache
+from core.scopus import Scopus
+from core.transport import Transport
+from tests.stub_server import StubServer
+
+
+def route(method, path):
+    if path.startswith("/doi/"):
+        return 302, {"Location": "/publisher/article"}, b""
+    return 200, {"Content-Type": "application/json"}, json.dumps({"path": path}).encode()
+
+
+def test_transport_reuses_connections():
+    with StubServer(route) as stub:
+        transport = Transport(pool_size=2)
+        for i in range(20):
+            response = transport.get(f"{stub.url}/content/{i}")
+            assert response.json() == {"path": f"/content/{i}"}
+            assert response.headers["Content-Encoding"] == "gzip"
+        assert stub.connections == 1
+
+
+def test_rate_limiter_adapts_to_quota_headers():
+    limiter = AdaptiveRateLimiter(rate=10, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.45
+
+    limiter.update({"X-RateLimit-Remaining": "20", "X-RateLimit-Reset": str(time.time() + 100)})
+    assert limiter.rate == pytest.approx(0.2, rel=0.05)
+    limiter.throttled({})
+    assert limiter.rate == pytest.approx(0.1, rel=0.05)
+    limiter.update({})
+    assert limiter.rate == pytest.approx(1.1, rel=0.05)
+
+
+def test_rate_limiter_waits_outside_its_lock():
+    limiter = AdaptiveRateLimiter(rate=10, burst=1)
+    limiter.pause(0.5)
+    waiter = threading.Thread(target=limiter.acquire)
+    waiter.start()
+    time.sleep(0.05)
+    # A caller waiting on a paused bucket does not hold back the adaptation of the rate
+    start = time.monotonic()
+    limiter.update({})
+    limiter.throttled({})
+    assert time.monotonic() - start < 0.1
+    waiter.join()
+
+
+def test_stubborn_url_open_backs_off_on_zero_retry_after(monkeypatch):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    answers = [(429, {"Retry-After": "0"}, b""), (200, {}, b"{}")]
+    backoffs = []
+    monkeypatch.setattr("core.scopus.backoff", lambda attempt: backoffs.append(attempt) or 0)
+    limiter = AdaptiveRateLimiter(rate=10, burst=1)
+    with StubServer(lambda method, path: answers.pop(0)) as stub:
+        q = Scopus(persistence=None, search_query="a", date_range="2020", rate_limiter=limiter, transport=Transport())
+        assert q.stubborn_url_open(f"{stub.url}/content/search/scopus").status_code == 200
+    assert backoffs == [0]
+
+
+def test_stubborn_url_open_retries_after_429(monkeypatch):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    answers = [
+        (429, {"Retry-After": "0.2"}, b""),
+        (200, {"X-RateLimit-Remaining": "5000", "X-RateLimit-Reset": str(time.time() + 3600)}, b"{}"),
+    ]
+    limiter = AdaptiveRateLimiter(rate=10, burst=1)
+    with StubServer(lambda method, path: answers.pop(0)) as stub:
+        q = Scopus(persistence=None, search_query="a", date_range="2020", rate_limiter=limiter, transport=Transport())
+        start = time.monotonic()
+        response = q.stubborn_url_open(f"{stub.url}/content/search/scopus")
+        assert response.status_code == 200
+        assert time.monotonic() - start >= 0.2
+        assert limiter.rate == pytest.approx(6, rel=0.05)
+
+
+def test_stubborn_url_open_closes_failed_streams(monkeypatch):
+    monkeypatch.setenv("ELSEVIER_API_KEY", "key")
+    monkeypatch.setattr("core.scopus.backoff", lambda attempt: 0)
+    answers = [(503, {}, b"busy"), (429, {}, b"slow down"), (200, {}, b"{}")]
+    closed = []
+    close = requests.Response.close
+    monkeypatch.setattr(requests.Response, "close", lambda self: closed.append(self.status_code) or close(self))
+    with StubServer(lambda method, path: answers.pop(0)) as stub:
+        q = Scopus(persistence=None, search_query="a", date_range="2020", transport=Transport())
+        q.rate_limiter = AdaptiveRateLimiter(rate=1000, burst=10)
+        response = q.stubborn_url_open(f"{stub.url}/content/search/scopus", stream=True)
+        assert response.status_code == 200
+        assert closed == [503, 429]
+
+
+def test_response_cache_strips_api_key_and_works_offline(tmp_path):
+    with StubServer(route) as stub:
+        cache = ResponseCache(path=tmp_path / "cache.db", ttl={"abstract": 3600})
+        transport = Transport(cache=cache)
+        url = f"{stub.url}/content/abstract/eid/1"
+        assert transport.get(f"{url}?apiKey=one").json() == {"path": "/content/abstract/eid/1?apiKey=one"}
+        assert transport.get(f"{url}?apiKey=two").json() == {"path": "/content/abstract/eid/1?apiKey=one"}
+        transport.get(f"{stub.url}/content/search/scopus?apiKey=one")
+        assert len(stub.requests) == 2
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.offline = True
+    assert transport.get(f"{url}?apiKey=three").from_cache
+    with pytest.raises(CacheMiss):
+        transport.get(f"{stub.url}/content/abstract/eid/2")
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    with StubServer(route) as stub:
+        cache = ResponseCache(path=tmp_path / "cache.db", ttl={"author": 3600}, max_bytes=100)
+        transport = Transport(cache=cache)
+        for i in range(4):
+            transport.get(f"{stub.url}/content/author/author_id/{i}")
+        transport.get(f"{stub.url}/content/author/author_id/3")
+        assert len(stub.requests) == 4
+        transport.get(f"{stub.url}/content/author/author_id/0")
+        assert len(stub.requests) == 5
+
+
+def test_doi_resolver_follows_redirects_to_final_host():
+    def route(method, path):
+        if path == "/doi/10.1000/hop":
+            return 302, {"Location": "/doi/10.1000/1"}, b""
+        if path.startswith("/doi/10.1000/"):
+            # A linking host of the publisher, like linkinghub.elsevier.com, is only one more hop
+            return 302, {"Location": f"http://localhost:{port}/linking{path[4:]}"}, b""
+        if path.startswith("/linking/"):
+            return 302, {"Location": f"http://127.0.0.1:{port}/article{path[8:]}"}, b""
+        if path.startswith("/article/"):
+            return 200, {}, b""
+        return 404, {}, b""
+
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    with StubServer(route) as stub:
+        port = stub.url.rsplit(":", 1)[1]
+        resolver = DoiResolver(transport=Transport(pool_size=4), resolver_url=f"{stub.url}/doi/", workers=4, per_host=2)
+        dois = [f"10.1000/{i}" for i in range(20)] + ["10.1000/hop", "bad"]
+        assert resolver.resolve_all(dois, store=orm, batch_size=5) == 21
+        assert resolver.failed == 1
+        # Only HEAD requests, and every DOI reaches the article after the linking host
+        assert {method for method, _ in stub.requests} == {"HEAD"}
+        assert sum(path.startswith("/article/") for _, path in stub.requests) == 21
+        assert stub.connections <= 4
+
+    with orm.db.engine.connect() as conn:
+        assert set(conn.exec_driver_sql("SELECT eurl FROM doi_eurl")) == {(f"127.0.0.1:{port}",)}
+
+
+def test_doi_resolver_gives_up_after_max_redirects():
+    def route(method, path):
+        return 302, {"Location": "/doi/loop"}, b""
+
+    with StubServer(route) as stub:
+        resolver = DoiResolver(transport=Transport(), resolver_url=f"{stub.url}/doi/", max_redirects=3)
+        with pytest.raises(RuntimeError):
+            resolver.resolve("loop")
+        assert len(stub.requests) == 4
+
+
+def test_doi_resolver_keeps_host_of_refused_pages():
+    def route(method, path):
+        if path.startswith("/doi/10.1000/"):
+            return 302, {"Location": "/article"}, b""
+        if path == "/article":
+            # Bot blocking of the publisher, GET is refused too
+            return 403, {}, b""
+        return 404, {}, b""
+
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    with StubServer(route) as stub:
+        resolver = DoiResolver(transport=Transport(), resolver_url=f"{stub.url}/doi/")
+        assert resolver.resolve_all(["10.1000/1", "10.1000/2", "bad"], store=orm) == 2
+        assert resolver.failed == 1
+        host = stub.url.split("/")[2]
+
+    with orm.db.engine.connect() as conn:
+        assert sorted(conn.exec_driver_sql("SELECT doi, eurl FROM doi_eurl")) == [
+            ("10.1000/1", host),
+            ("10.1000/2", host),
+        ]
+
+
+def test_doi_resolver_predicts_host_by_prefix():
+    def route(method, path):
+        if path.startswith("/doi/"):
+            return 302, {"Location": "/article"}, b""
+        return 200, {}, b""
+
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    with StubServer(route) as stub:
+        host = stub.url.split("/")[2]
+        orm.set_doi_eurls([(f"10.1000/{i}", host) for i in range(5)] + [("10.2000/0", "other.example")])
+        cache = PrefixHostCache(min_samples=5, sample_rate=0)
+        resolver = DoiResolver(transport=Transport(), resolver_url=f"{stub.url}/doi/", prefix_cache=cache)
+        dois = [f"10.1000/{i}" for i in range(5, 15)] + [f"10.2000/{i}" for i in range(1, 6)]
+        assert resolver.resolve_all(dois, store=orm) == 15
+        assert sorted(path for _, path in stub.requests if path.startswith("/doi/")) == [
+            f"/doi/10.2000/{i}" for i in range(1, 6)
+        ]
+        assert (cache.hits, cache.misses, cache.mismatches) == (10, 5, 0)
+
+        # Sampled predictions are checked against the network
+        cache = PrefixHostCache(min_samples=5, sample_rate=1)
+        cache.learn([("10.3000", "stale.example", 5)])
+        resolver = DoiResolver(transport=Transport(), resolver_url=f"{stub.url}/doi/", prefix_cache=cache)
+        resolver.resolve_all(["10.3000/1", "10.3000/2"], store=orm)
+        assert (cache.sampled, cache.mismatches) == (2, 2)
+
+
+def test_doi_resolver_learns_prefixes_within_a_run():
+    def route(method, path):
+        if path.startswith("/doi/"):
+            return 302, {"Location": "/article"}, b""
+        return 200, {}, b""
+
+    orm = SqlAlchemyORM(":memory:")
+    orm.db.create_database()
+    with StubServer(route) as stub:
+        cache = PrefixHostCache(min_samples=3, sample_rate=0)
+        resolver = DoiResolver(transport=Transport(), resolver_url=f"{stub.url}/doi/", workers=1, prefix_cache=cache)
+        dois = (f"10.1000/{i}" for i in range(30))
+        assert resolver.resolve_all(dois, store=orm, window=2) == 30
+        # Only the DOIs looked up before the prefix had 3 resolutions go to the network
+        resolved = [path for _, path in stub.requests if path.startswith("/doi/")]
+        assert len(resolved) <= 4
+        assert cache.hits == 30 - len(resolved)
+
+
+def test_doi_resolver_stores_hosts_while_reading_dois(tmp_path):
+    def route(method, path):
+        if path.startswith("/doi/"):
+            return 302, {"Location": "/article"}, b""
+        return 200, {}, b""
+
+    # Rollback journal, where an open read would keep the resolved hosts from being committed
+    orm = SqlAlchemyORM(str(tmp_path / "documents.db"))
+    orm.db.create_database()
+    orm.save_rows(document_row({"eid": f"2-s2.0-{i}", "prism:doi": f"10.1000/{i}"}, "q", "Scopus") for i in range(60))
+    with StubServer(route) as stub:
+        resolver = DoiResolver(transport=Transport(), resolver_url=f"{stub.url}/doi/", workers=2)
+        assert resolver.resolve_all(orm.iter_doi(chunk_size=2), store=orm, batch_size=1) == 60
+    assert orm.get_doi() == []
+    orm.db.close()